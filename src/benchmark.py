@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from hits import HITS, DatasetReader
+from dataset_fetcher import ListToMatrixConverter, ORDERINGS
+
+def generate_graph(n, avg_degree=10, exponent=2.1, seed=0):
+	"""Returns (users, adj_list) of a reproducible directed graph whose in and
+	out degrees follow power laws, like follower graphs on Twitter
+
+	Edges are drawn with probability proportional to a popularity weight of
+	the source (how much it follows) and of the destination (how much it is
+	followed), as in the Chung-Lu model. Both dictionaries have the layout
+	saved by DatasetFetcher.save_dataset, with every edge stored as a friend
+
+	Args:
+		n: Number of users
+		avg_degree: Average number of friends per user
+		exponent: Exponent of the power law of the degrees
+		seed: Seed of the random number generator
+	"""
+	rng = np.random.RandomState(seed)
+	weights = np.arange(1, n + 1, dtype=np.float64) ** (-1 / (exponent - 1))
+	weights /= weights.sum()
+	m = int(n * avg_degree)
+	src = rng.choice(n, size=m, p=weights[rng.permutation(n)])
+	dst = rng.choice(n, size=m, p=weights[rng.permutation(n)])
+	keep = src != dst
+	src = src[keep]
+	dst = dst[keep]
+
+	# Distinct, Twitter-like user ids
+	ids = 10 ** 6 + np.cumsum(rng.randint(1, 2 ** 20, size=n, dtype=np.int64))
+	ids = ids[rng.permutation(n)]
+	users = {}
+	for i, user_id in enumerate(ids.tolist()):
+		users[user_id] = {'name': 'User ' + str(i), 'screen_name': 'user' + str(i)}
+
+	order = np.argsort(src, kind='mergesort')
+	friends = np.split(ids[dst[order]], np.cumsum(np.bincount(src, minlength=n))[:-1])
+	adj_list = {}
+	for i, user_id in enumerate(ids.tolist()):
+		adj_list[user_id] = {'friends': friends[i].tolist(), 'followers': []}
+	return users, adj_list
+
+def save_graph(directory, users, adj_list):
+	"""Saves a generated graph as the users and adj_list files of a dataset,
+	and returns their paths
+
+	Args:
+		directory: Directory to save the files in
+		users: Dictionary of the details of all users
+		adj_list: The adjacency list
+	"""
+	users_path = os.path.join(directory, 'users')
+	adj_list_path = os.path.join(directory, 'adj_list')
+	with open(users_path, 'wb') as f:
+		pickle.dump(users, f)
+	with open(adj_list_path, 'wb') as f:
+		pickle.dump(adj_list, f)
+	return users_path, adj_list_path
+
+def measure(function, profile_memory=True, repeats=1):
+	"""Runs function and returns (result, seconds, peak_bytes), where seconds
+	is the list of the times of repeats plain runs and result is that of the
+	last run
+
+	If profile_memory is True, function is run again under tracemalloc to find
+	the peak memory allocated by it (peak_bytes is None otherwise), so that
+	tracing does not slow the timed runs
+
+	Args:
+		function: Function taking no arguments
+		profile_memory: True if the peak memory is to be measured
+		repeats: Number of timed runs
+	"""
+	seconds = []
+	for _ in range(repeats):
+		# The result of the previous run is dropped so it is not held during this one
+		result = None
+		start = time.perf_counter()
+		result = function()
+		seconds.append(time.perf_counter() - start)
+
+	peak_bytes = None
+	if profile_memory:
+		del result
+		tracemalloc.start()
+		try:
+			result = function()
+			_, peak_bytes = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+	return result, seconds, peak_bytes
+
+def run(
+	sizes, engines, dense_limit, avg_degree, epsilon, profile_memory, seed, log,
+	ordering=None, repeats=3):
+	"""Runs the benchmarks and returns the report
+
+	Args:
+		sizes: Numbers of users of the generated graphs
+		engines: Engines of HITS.calc_scores to benchmark on sparse matrices
+		dense_limit: Largest size for which dense matrices are benchmarked
+		avg_degree: Average number of friends per user
+		epsilon: Tolerance for convergence of HITS
+		profile_memory: True if peak memory is to be measured
+		seed: Seed of the random number generator
+		log: Function used to report progress
+		ordering: Ordering of the users in the converted link matrices (see
+		ListToMatrixConverter.convert)
+		repeats: Number of timed runs of each stage. The fastest is reported as
+		seconds, as it is the least disturbed by the rest of the machine
+	"""
+	results = []
+
+	def record(size, stage, seconds, peak_bytes, **extra):
+		entry = {'size': size, 'stage': stage, 'seconds': min(seconds),
+			'median_seconds': float(np.median(seconds)), 'runs': seconds,
+			'peak_bytes': peak_bytes}
+		entry.update(extra)
+		results.append(entry)
+		log('%9d %-28s %10.4fs %s' % (size, stage, min(seconds),
+			'' if peak_bytes is None else '%.1f MiB' % (peak_bytes / 2 ** 20)))
+		return entry
+
+	for size in sizes:
+		directory = tempfile.mkdtemp(prefix='hits_benchmark_')
+		try:
+			users, adj_list = generate_graph(size, avg_degree, seed=seed)
+			users_path, adj_list_path = save_graph(directory, users, adj_list)
+			del users, adj_list
+			map_path = os.path.join(directory, 'map')
+			sparse_path = os.path.join(directory, 'sparse_link_matrix')
+			mmap_path = os.path.join(directory, 'mmap_link_matrix')
+			dense_path = os.path.join(directory, 'dense_link_matrix')
+			dense = size <= dense_limit
+
+			def convert():
+				c = ListToMatrixConverter(adj_list_path)
+				c.convert(ordering)
+				return c
+			c, seconds, peak = measure(convert, profile_memory, repeats)
+			converted = record(size, 'convert', seconds, peak)
+
+			_, seconds, peak = measure(
+				lambda: c.save(map_path, sparse_path, use_sparse=True), profile_memory, repeats)
+			record(size, 'save_sparse', seconds, peak)
+			with open(map_path + '.json') as f:
+				converted['edges'] = json.load(f)['edges']
+			_, seconds, peak = measure(
+				lambda: c.save('', mmap_path, use_sparse=True, use_mmap=True), profile_memory, repeats)
+			record(size, 'save_mmap', seconds, peak)
+			if dense:
+				_, seconds, peak = measure(
+					lambda: c.save('', dense_path), profile_memory, repeats)
+				record(size, 'save_dense', seconds, peak)
+			del c
+
+			r = DatasetReader()
+			users, seconds, peak = measure(
+				lambda: r.read_users(users_path), profile_memory, repeats)
+			record(size, 'read_users', seconds, peak)
+			index_id_map, seconds, peak = measure(
+				lambda: r.read_map(map_path), profile_memory, repeats)
+			record(size, 'read_map', seconds, peak)
+			link_matrix, seconds, peak = measure(
+				lambda: r.read_link_matrix(sparse_path, is_sparse=True), profile_memory, repeats)
+			record(size, 'read_sparse', seconds, peak)
+			_, seconds, peak = measure(
+				lambda: r.read_link_matrix(mmap_path, is_sparse=True, use_mmap=True), profile_memory, repeats)
+			record(size, 'read_mmap', seconds, peak)
+
+			for engine in engines:
+				def score():
+					h = HITS(link_matrix, users, index_id_map, is_sparse=True,
+						history={'enabled': False})
+					h.calc_scores(epsilon=epsilon, engine=engine)
+					return h.get_stats()
+				stats, seconds, peak = measure(score, profile_memory, repeats)
+				record(size, 'calc_scores_sparse_' + engine, seconds, peak,
+					iterations=int(stats['iterations']))
+
+			if dense:
+				link_matrix, seconds, peak = measure(
+					lambda: r.read_link_matrix(dense_path), profile_memory, repeats)
+				record(size, 'read_dense', seconds, peak)
+
+				def score_dense():
+					h = HITS(link_matrix, users, index_id_map, is_sparse=False,
+						history={'enabled': False})
+					h.calc_scores(epsilon=epsilon)
+					return h.get_stats()
+				stats, seconds, peak = measure(score_dense, profile_memory, repeats)
+				record(size, 'calc_scores_dense_power', seconds, peak,
+					iterations=int(stats['iterations']))
+		finally:
+			shutil.rmtree(directory)
+
+	return {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'scipy': scipy.__version__,
+			'machine': platform.machine(),
+			'seed': seed,
+			'avg_degree': avg_degree,
+			'epsilon': epsilon,
+			'ordering': ordering
+		},
+		'results': results
+	}
+
+def compare(report, baseline, threshold):
+	"""Returns a list of descriptions of the results of report that are slower
+	or use more memory than the same results of baseline by more than a factor
+	of threshold. Times are compared by the fastest of the repeated runs
+
+	Args:
+		report: Report returned by run
+		baseline: Report of an earlier run
+		threshold: Factor (eg. 1.2 for 20%) above which a result is a regression
+	"""
+	old = {(entry['size'], entry['stage']): entry for entry in baseline['results']}
+	regressions = []
+	for entry in report['results']:
+		key = (entry['size'], entry['stage'])
+		if key not in old:
+			continue
+		for measurement in ('seconds', 'peak_bytes'):
+			before = old[key][measurement]
+			after = entry[measurement]
+			if before and after and after > before * threshold:
+				regressions.append('%d %s %s: %.4g -> %.4g (x%.2f)' % (
+					key[0], key[1], measurement, before, after, after / before))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Benchmark conversion, loading and scoring on synthetic power law graphs')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5],
+		help='Numbers of users of the generated graphs (up to 10^7)')
+	parser.add_argument('--engines', nargs='+', default=['power', 'fused', 'svd'],
+		help='Engines of calc_scores to benchmark on sparse matrices')
+	parser.add_argument('--dense-limit', type=int, default=10 ** 4,
+		help='Largest size for which dense matrices are benchmarked')
+	parser.add_argument('--avg-degree', type=float, default=10,
+		help='Average number of friends per user')
+	parser.add_argument('--epsilon', type=float, default=1e-10,
+		help='Tolerance for convergence of HITS')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--ordering', default=None, choices=ORDERINGS[1:],
+		help='Reorder the users of the link matrices for locality')
+	parser.add_argument('--repeats', type=int, default=3,
+		help='Number of timed runs of each stage, of which the fastest is reported')
+	parser.add_argument('--no-memory', action='store_true',
+		help='Do not measure peak memory (halves the running time)')
+	parser.add_argument('--output', default='benchmark.json',
+		help='Path to the file where the report is to be stored')
+	parser.add_argument('--compare', default='',
+		help='Path to the report of an earlier run to check for regressions')
+	parser.add_argument('--threshold', type=float, default=1.2,
+		help='Slowdown factor counted as a regression')
+	args = parser.parse_args()
+
+	report = run(args.sizes, args.engines, args.dense_limit, args.avg_degree,
+		args.epsilon, not args.no_memory, args.seed, print, args.ordering, args.repeats)
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=1)
+
+	if args.compare != '':
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions = compare(report, baseline, args.threshold)
+		for regression in regressions:
+			print('Regression:', regression)
+		if regressions:
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
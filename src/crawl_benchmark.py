@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from benchmark import generate_graph
+from dataset_fetcher import DatasetFetcher, ConcurrentDatasetFetcher, Logger
+from fake_twitter_api import FakeTwitterGraph, FakeTwitterAPI
+
+def crawl(graph, seed_user, workers, credentials, live_save, checkpoint, directory, args):
+	"""Crawls a FakeTwitterGraph and returns the measurements of the crawl
+
+	Args:
+		graph: The FakeTwitterGraph
+		seed_user: id of the user to start the crawl with
+		workers: Number of concurrent requests, or 0 for DatasetFetcher
+		credentials: Number of (fake) credentials
+		live_save: True if users and edges are journaled
+		checkpoint: True if the crawl is checkpointed
+		directory: Directory for the journal and checkpoint
+		args: Parsed command line arguments
+	"""
+	limits = {'friends': args.calls_per_window, 'followers': args.calls_per_window}
+	apis = [FakeTwitterAPI(graph, args.latency, limits, args.window) for _ in range(credentials)]
+	logger = Logger(os.devnull, print_stdout=False)
+	journal_path = os.path.join(directory, 'journal')
+	checkpoint_path = os.path.join(directory, 'checkpoint') if checkpoint else ''
+	if workers == 0:
+		fetcher = DatasetFetcher(None, None, logger, api=apis[0])
+		start = time.perf_counter()
+		fetcher.get_dataset(seed_user, args.friends_limit, args.followers_limit,
+			args.limit, live_save, journal_path, checkpoint_path)
+	else:
+		fetcher = ConcurrentDatasetFetcher(None, logger, workers, apis,
+			limits=limits, window=args.window)
+		start = time.perf_counter()
+		fetcher.get_dataset(seed_user, args.friends_limit, args.followers_limit,
+			args.limit, live_save, journal_path)
+	seconds = time.perf_counter() - start
+	logger.close()
+
+	metrics = fetcher.get_metrics()
+	calls = sum(sum(api.calls.values()) for api in apis)
+	rate_limited = sum(sum(api.rate_limited.values()) for api in apis)
+	# Calls the rate limits allowed during the crawl, over all credentials
+	allowed = credentials * len(limits) * args.calls_per_window * max(seconds / args.window, 1)
+	return {
+		'seconds': seconds,
+		'users': metrics['users'],
+		'edges': metrics['edges'],
+		'users_per_min': metrics['users'] / seconds * 60,
+		'edges_per_min': metrics['edges'] / seconds * 60,
+		'api_calls': calls,
+		'rate_limited_calls': rate_limited,
+		'rate_limit_utilization': (calls - rate_limited) / allowed,
+		'sleep_time': metrics['sleep_time']
+	}
+
+def run(args, log):
+	"""Runs the crawls asked for by the command line arguments and returns the
+	report
+
+	Args:
+		args: Parsed command line arguments
+		log: Function used to report progress
+	"""
+	users, adj_list = generate_graph(args.size, args.avg_degree, seed=args.seed)
+	graph = FakeTwitterGraph(users, adj_list)
+	del users, adj_list
+	seed_user = int(graph.ids[0])
+
+	configurations = [
+		('sequential', 0, 1, False, False),
+		('sequential_journal', 0, 1, True, False),
+		('sequential_checkpoint', 0, 1, True, True)
+	]
+	for workers in args.workers:
+		configurations.append(('concurrent_%d' % workers, workers, args.credentials, False, False))
+
+	results = {}
+	for name, workers, credentials, live_save, checkpoint in configurations:
+		directory = tempfile.mkdtemp(prefix='crawl_benchmark_')
+		try:
+			result = crawl(graph, seed_user, workers, credentials, live_save,
+				checkpoint, directory, args)
+		finally:
+			shutil.rmtree(directory)
+		results[name] = result
+		log('%-24s %8.3fs %10.1f users/min %6d calls %5d limited %5.1f%% of limit' % (
+			name, result['seconds'], result['users_per_min'], result['api_calls'],
+			result['rate_limited_calls'], 100 * result['rate_limit_utilization']))
+
+	overhead = results['sequential_checkpoint']['seconds'] - results['sequential_journal']['seconds']
+	log('Checkpoint overhead: %.3fs' % overhead)
+	return {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'arguments': vars(args)
+		},
+		'results': results,
+		'checkpoint_overhead_seconds': overhead
+	}
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Benchmark crawls of a synthetic graph served by a fake Twitter API')
+	parser.add_argument('--size', type=int, default=10 ** 4,
+		help='Number of users of the generated graph')
+	parser.add_argument('--avg-degree', type=float, default=10,
+		help='Average number of friends per user')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--limit', type=int, default=200,
+		help='Maximum number of users to find friends and followers of')
+	parser.add_argument('--friends-limit', type=int, default=200)
+	parser.add_argument('--followers-limit', type=int, default=200)
+	parser.add_argument('--latency', type=float, default=0.01,
+		help='Seconds taken by each API call')
+	parser.add_argument('--calls-per-window', type=int, default=50,
+		help='Calls allowed per endpoint, credential and window')
+	parser.add_argument('--window', type=float, default=1.0,
+		help='Length of the rate limit window in seconds (900 for the real API)')
+	parser.add_argument('--credentials', type=int, default=4,
+		help='Number of credentials of the concurrent crawls')
+	parser.add_argument('--workers', type=int, nargs='*', default=[4, 8],
+		help='Numbers of concurrent requests to benchmark ConcurrentDatasetFetcher with')
+	parser.add_argument('--output', default='crawl_benchmark.json',
+		help='Path to the file where the report is to be stored')
+	args = parser.parse_args()
+
+	report = run(args, print)
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=1)
+
+if __name__ == '__main__':
+	main()
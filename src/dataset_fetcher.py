@@ -6,13 +6,555 @@ import numpy as np
 import scipy.sparse as sparse
 from datetime import datetime as dt
 import sys
+import array
+import struct
+import os
+import sqlite3
+import json
+import threading
+import collections
+import collections.abc
+import concurrent.futures
+import atexit
+
+def edges_to_csr(rows, cols, size, dtype=np.float64):
+	"""Returns a size x size CSR link matrix with a 1 at each (row, col) edge
+
+	Duplicate edges are removed. Memory and time are O(number of edges)
+
+	Args:
+		rows: Sequence (or array) of row indices of the edges
+		cols: Sequence (or array) of column indices of the edges
+		size: Number of users (rows and columns) in the link matrix
+		dtype: Type of the entries. Defaults to the float64 HITS scores with,
+		so that HITS does not have to convert them
+	"""
+	rows = np.asarray(rows, dtype=np.int64)
+	cols = np.asarray(cols, dtype=np.int64)
+
+	# Each edge as a single key; unique sorts the keys by row and then by
+	# column, which is exactly CSR order
+	keys = np.unique(rows * size + cols)
+	rows = keys // size
+	cols = keys % size
+
+	indptr = np.zeros(size + 1, dtype=np.int64)
+	np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+	index_dtype = np.int32 if size < 2 ** 31 and len(keys) < 2 ** 31 else np.int64
+	return sparse.csr_matrix(
+		(np.ones(len(keys), dtype=dtype), cols.astype(index_dtype),
+		indptr.astype(index_dtype)), shape=(size, size))
+
+def merge_edges(link_matrix, rows, cols, size):
+	"""Returns a size x size CSR link matrix with the edges of link_matrix and
+	a 1 at each new (row, col) edge. Users of link_matrix keep their indices,
+	and size may be larger to append users
+
+	The edges of link_matrix are taken in CSR order, which is already the
+	sorted order of their keys, so only the new edges are sorted and they are
+	inserted with one pass over the existing ones. Time is O(existing edges +
+	new edges log new edges)
+
+	Args:
+		link_matrix: Sparse link matrix with sorted indices
+		rows: Sequence (or array) of row indices of the new edges
+		cols: Sequence (or array) of column indices of the new edges
+		size: Number of users of the merged link matrix
+	"""
+	link_matrix = sparse.csr_matrix(link_matrix)
+	if not link_matrix.has_sorted_indices:
+		link_matrix = link_matrix.sorted_indices()
+	keys = np.repeat(np.arange(link_matrix.shape[0], dtype=np.int64) * size,
+		np.diff(link_matrix.indptr)) + link_matrix.indices
+	new_keys = np.unique(np.asarray(rows, dtype=np.int64) * size + np.asarray(cols, dtype=np.int64))
+	positions = np.searchsorted(keys, new_keys)
+	present = np.zeros(len(new_keys), dtype=bool)
+	inside = positions < len(keys)
+	present[inside] = keys[positions[inside]] == new_keys[inside]
+	keys = np.insert(keys, positions[~present], new_keys[~present])
+
+	indptr = np.zeros(size + 1, dtype=np.int64)
+	np.cumsum(np.bincount(keys // size, minlength=size), out=indptr[1:])
+	index_dtype = np.int32 if size < 2 ** 31 and len(keys) < 2 ** 31 else np.int64
+	return sparse.csr_matrix(
+		(np.ones(len(keys), dtype=link_matrix.dtype), (keys % size).astype(index_dtype),
+		indptr.astype(index_dtype)), shape=(size, size))
+
+ORDERINGS = (None, 'degree', 'rcm', 'community')
+
+def _label_propagation(symmetric, iterations=10):
+	"""Returns a community label for each user, found by synchronous label
+	propagation: every user takes the label most common among its neighbours
+	(the smallest one on ties) until no label changes
+
+	Args:
+		symmetric: Symmetric CSR link matrix
+		iterations: Largest number of rounds
+	"""
+	n = symmetric.shape[0]
+	labels = np.arange(n, dtype=np.int64)
+	rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(symmetric.indptr))
+	cols = symmetric.indices
+	for _ in range(iterations):
+		# Sorted keys are grouped by user, and then ordered by label
+		keys, counts = np.unique(rows * n + labels[cols], return_counts=True)
+		key_rows = keys // n
+		order = np.lexsort((-counts, key_rows))
+		first = order[np.r_[0, np.flatnonzero(np.diff(key_rows[order])) + 1]] if len(order) else order
+		new_labels = labels.copy()
+		new_labels[key_rows[first]] = keys[first] % n
+		if np.array_equal(new_labels, labels):
+			break
+		labels = new_labels
+	return labels
+
+def node_order(link_matrix, ordering):
+	"""Returns the order in which users are to be indexed for better locality
+	of the sparse products of HITS, as an array of current indices
+
+	Args:
+		link_matrix: Square sparse link matrix
+		ordering: None to keep the current order, 'degree' for the users with
+		the most friends and followers first, 'rcm' for reverse Cuthill-McKee
+		(which keeps the links of each user close to the diagonal), or
+		'community' for the users of each community found by label propagation
+		next to each other, largest community first
+	"""
+	n = link_matrix.shape[0]
+	if ordering is None:
+		return np.arange(n)
+	if ordering not in ORDERINGS:
+		raise ValueError('Unknown ordering: ' + str(ordering))
+	link_matrix = sparse.csr_matrix(link_matrix)
+	degree = np.diff(link_matrix.indptr) + np.bincount(link_matrix.indices, minlength=n)
+	if ordering == 'degree':
+		return np.argsort(-degree, kind='mergesort')
+	symmetric = (link_matrix + link_matrix.T).tocsr()
+	if ordering == 'rcm':
+		from scipy.sparse.csgraph import reverse_cuthill_mckee
+		return reverse_cuthill_mckee(symmetric, symmetric_mode=True).astype(np.int64)
+	labels = _label_propagation(symmetric)
+	sizes = np.bincount(labels, minlength=n)
+	return np.lexsort((-degree, labels, -sizes[labels]))
+
+def save_csr_mmap(link_matrix_path, link_matrix, metadata=None):
+	"""Saves a sparse link matrix in the memory-mappable CSR format
+
+	The format is a directory holding the indptr, indices and data arrays of
+	the CSR matrix as uncompressed .npy files, and a small JSON header naming
+	them. Each save writes arrays under new names and then atomically replaces
+	the header with os.replace, so processes that have the matrix mapped keep
+	reading the old files (which are only unlinked), and loads see either the
+	old matrix or the new one, never a mix
+
+	Args:
+		link_matrix_path: Path to the directory to save the matrix in
+		link_matrix: The (sparse) link matrix
+		metadata: Dictionary of further (JSON serializable) entries of the
+		header, eg. the ordering of the users
+	"""
+	link_matrix = sparse.csr_matrix(link_matrix)
+	os.makedirs(link_matrix_path, exist_ok=True)
+	header = dict(metadata or {})
+	header.update({
+		'format': 'csr',
+		'version': 1,
+		'shape': list(link_matrix.shape),
+		'nnz': int(link_matrix.nnz),
+		'files': {}
+	})
+	token = os.urandom(6).hex()
+	for name in ('indptr', 'indices', 'data'):
+		file_name = name + '.' + token + '.npy'
+		np.save(os.path.join(link_matrix_path, file_name), getattr(link_matrix, name))
+		header[name] = getattr(link_matrix, name).dtype.str
+		header['files'][name] = file_name
+	header_path = os.path.join(link_matrix_path, 'header.json')
+	with open(header_path + '.' + token, 'w') as f:
+		json.dump(header, f)
+	os.replace(header_path + '.' + token, header_path)
+
+	# Arrays of earlier saves
+	for file_name in os.listdir(link_matrix_path):
+		if (file_name.endswith('.npy') and file_name.split('.')[0] in ('indptr', 'indices', 'data')
+			and file_name not in header['files'].values()):
+			os.remove(os.path.join(link_matrix_path, file_name))
+
+def load_csr_mmap(link_matrix_path):
+	"""Returns the sparse link matrix saved by save_csr_mmap. Its arrays are
+	read-only memory maps of the files, so nothing is read until it is used
+	and the pages are shared by all processes that load the same matrix
+
+	Args:
+		link_matrix_path: Path to the directory the matrix was saved in
+	"""
+	for attempt in range(3):
+		with open(os.path.join(link_matrix_path, 'header.json')) as f:
+			header = json.load(f)
+		if header['format'] != 'csr' or header['version'] != 1:
+			raise ValueError('Unknown link matrix format in ' + link_matrix_path)
+		# Headers of older saves do not name the files
+		files = header.get('files', {})
+		try:
+			arrays = [np.load(os.path.join(link_matrix_path, files.get(name, name + '.npy')),
+				mmap_mode='r') for name in ('data', 'indices', 'indptr')]
+		except FileNotFoundError:
+			# A new save replaced the header and removed these files after the
+			# header was read
+			if attempt == 2:
+				raise
+			continue
+		return sparse.csr_matrix(tuple(arrays), shape=tuple(header['shape']), copy=False)
+
+class UserStore():
+	"""An instance of UserStore holds the details of all users in columns, in
+	link matrix index order: an int64 array of ids, and the UTF-8 encoded
+	names and screen names concatenated into byte buffers with an array of
+	offsets each. Every column can be memory-mapped
+
+	Lookups from ids and screen names to indices are vectorized binary
+	searches over the sorted ids and the sorted, fixed width screen names
+	saved with the columns, so they read only O(log n) entries
+	"""
+
+	_columns = ('ids', 'id_order', 'name_offsets', 'screen_name_offsets',
+		'screen_name_order')
+	# Saved by newer versions of save, and computed once when missing
+	_sorted_columns = ('sorted_ids', 'sorted_screen_names')
+
+	def __init__(self, user_store_path, use_mmap=True):
+		"""Initializes an instance of UserStore from a saved store
+
+		Args:
+			user_store_path: Path to the directory the store was saved in
+			use_mmap: True if the columns are to be memory-mapped instead of read
+			into memory
+		"""
+		with open(os.path.join(user_store_path, 'header.json')) as f:
+			header = json.load(f)
+		if header['format'] != 'users' or header['version'] != 1:
+			raise ValueError('Unknown user store format in ' + user_store_path)
+		mmap_mode = 'r' if use_mmap else None
+		for name in UserStore._columns:
+			setattr(self, '_' + name, np.load(
+				os.path.join(user_store_path, name + '.npy'), mmap_mode=mmap_mode))
+		for name in ('names', 'screen_names'):
+			path = os.path.join(user_store_path, name + '.bin')
+			if use_mmap and os.path.getsize(path) > 0:
+				buffer = np.memmap(path, dtype=np.uint8, mode='r')
+			else:
+				buffer = np.fromfile(path, dtype=np.uint8)
+			setattr(self, '_' + name, buffer)
+		for name in UserStore._sorted_columns:
+			path = os.path.join(user_store_path, name + '.npy')
+			setattr(self, '_' + name, np.load(path, mmap_mode=mmap_mode)
+				if os.path.exists(path) else None)
+
+	@staticmethod
+	def save(user_store_path, ids, users):
+		"""Saves the details of users as a user store
+
+		Args:
+			user_store_path: Path to the directory to save the store in
+			ids: User ids in link matrix index order
+			users: Dictionary from user id to {'name': '', 'screen_name': ''}
+		"""
+		os.makedirs(user_store_path, exist_ok=True)
+		ids = np.asarray(ids, dtype=np.int64)
+		columns = {'ids': ids, 'id_order': np.argsort(ids, kind='mergesort')}
+		for name in ('name', 'screen_name'):
+			encoded = [users[user_id][name].encode('utf-8') for user_id in ids.tolist()]
+			offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+			np.cumsum([len(value) for value in encoded], out=offsets[1:])
+			columns[name + '_offsets'] = offsets
+			with open(os.path.join(user_store_path, name + 's.bin'), 'wb') as f:
+				f.write(b''.join(encoded))
+			if name == 'screen_name':
+				screen_names = np.array(encoded, dtype=bytes)
+				columns['screen_name_order'] = np.argsort(screen_names, kind='mergesort')
+				columns['sorted_screen_names'] = screen_names[columns['screen_name_order']]
+		columns['sorted_ids'] = ids[columns['id_order']]
+		for name in UserStore._columns + UserStore._sorted_columns:
+			np.save(os.path.join(user_store_path, name + '.npy'), columns[name])
+		with open(os.path.join(user_store_path, 'header.json'), 'w') as f:
+			json.dump({'format': 'users', 'version': 1, 'count': len(ids)}, f)
+
+	def __len__(self):
+		return len(self._ids)
+
+	def get_ids(self):
+		"""Returns the array of user ids in link matrix index order
+		"""
+		return self._ids
+
+	def get_id(self, index):
+		"""Returns the user id at a link matrix index
+		"""
+		return int(self._ids[index])
+
+	def get_name(self, index):
+		"""Returns the name of the user at a link matrix index
+		"""
+		return bytes(self._names[
+			self._name_offsets[index]:self._name_offsets[index + 1]]).decode('utf-8')
+
+	def get_screen_name(self, index):
+		"""Returns the screen name of the user at a link matrix index
+		"""
+		return bytes(self._screen_names[
+			self._screen_name_offsets[index]:self._screen_name_offsets[index + 1]]).decode('utf-8')
+
+	def indices_of_ids(self, ids):
+		"""Returns the link matrix index of each user id, or -1 for unknown ids
+
+		Args:
+			ids: Array of user ids
+		"""
+		ids = np.asarray(ids, dtype=np.int64)
+		if len(self._ids) == 0:
+			return np.full(ids.shape, -1, dtype=np.int64)
+		if self._sorted_ids is None:
+			self._sorted_ids = self._ids[self._id_order]
+		sorted_ids = self._sorted_ids
+		pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+		return np.where(sorted_ids[pos] == ids, self._id_order[pos], -1)
+
+	def indices_of_screen_names(self, screen_names):
+		"""Returns the link matrix index of each screen name, or -1 for unknown
+		screen names
+
+		Args:
+			screen_names: List of screen names
+		"""
+		if self._sorted_screen_names is None:
+			# Stores saved before the sorted screen names were: spread the buffer
+			# into a fixed width array of byte strings, without a loop over the
+			# users
+			offsets = np.asarray(self._screen_name_offsets)
+			lengths = np.diff(offsets)
+			width = max(int(lengths.max()) if len(lengths) else 0, 1)
+			padded = np.zeros((len(lengths), width), dtype=np.uint8)
+			rows = np.repeat(np.arange(len(lengths)), lengths)
+			cols = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+			padded[rows, cols] = self._screen_names
+			self._sorted_screen_names = padded.view('S' + str(width)).ravel()[
+				self._screen_name_order]
+		queries = np.array([name.encode('utf-8') for name in screen_names], dtype=bytes)
+		if len(self._sorted_screen_names) == 0:
+			return np.full(len(queries), -1, dtype=np.int64)
+		pos = np.minimum(np.searchsorted(self._sorted_screen_names, queries),
+			len(self._sorted_screen_names) - 1)
+		return np.where(self._sorted_screen_names[pos] == queries,
+			self._screen_name_order[pos], -1)
+
+	def as_index_id_map(self):
+		"""Returns a read-only view of the store that can be used in place of the
+		index_id_map dictionary
+		"""
+		return _IndexIdView(self)
+
+	def as_users(self):
+		"""Returns a read-only view of the store that can be used in place of the
+		users dictionary
+		"""
+		return _UsersView(self)
+
+class _IndexIdView(collections.abc.Mapping):
+	"""Mapping from link matrix index to user id backed by a UserStore
+	"""
+
+	def __init__(self, store):
+		self.store = store
+
+	def __getitem__(self, index):
+		if not 0 <= index < len(self.store):
+			raise KeyError(index)
+		return self.store.get_id(index)
+
+	def __iter__(self):
+		return iter(range(len(self.store)))
+
+	def __len__(self):
+		return len(self.store)
+
+class _UsersView(collections.abc.Mapping):
+	"""Mapping from user id to {'name': '', 'screen_name': ''} backed by a
+	UserStore
+	"""
+
+	def __init__(self, store):
+		self.store = store
+
+	def __getitem__(self, user_id):
+		index = self.store.indices_of_ids([user_id])[0]
+		if index < 0:
+			raise KeyError(user_id)
+		return {
+			'name': self.store.get_name(index),
+			'screen_name': self.store.get_screen_name(index)
+		}
+
+	def __iter__(self):
+		return iter(self.store.get_ids().tolist())
+
+	def __len__(self):
+		return len(self.store)
+
+class CrawlGraph(collections.abc.Mapping):
+	"""An instance of CrawlGraph holds the users and edges found during a crawl
+	in compact columns
+
+	User ids are interned to dense indices in the order in which users were
+	visited, which is the link matrix order. Names and screen names are UTF-8
+	encoded into byte buffers with an array of offsets each (as in
+	UserStore), and each edge is kept as a single int64 key row << 32 | col
+	in a typed array, where row follows col. An edge seen both as a friend
+	and as a follower is the same key, and duplicates are removed whenever
+	the number of edges has doubled since the last deduplication, so memory
+	is 8 bytes per distinct edge. Indices must fit in 31 bits
+
+	As a Mapping it maps each user id, in visit order, to
+	{'name': '', 'screen_name': ''}, like the users dictionary saved by
+	DatasetFetcher.save_dataset
+	"""
+
+	_min_deduplicate = 2 ** 16
+
+	def __init__(self):
+		"""Initializes an empty instance of CrawlGraph
+		"""
+		self._index = {}
+		self._ids = array.array('q')
+		self._names = bytearray()
+		self._screen_names = bytearray()
+		self._name_offsets = array.array('q', [0])
+		self._screen_name_offsets = array.array('q', [0])
+		self._edges = array.array('q')
+		self._unique_edges = 0
+
+	def add_user(self, user_id, name, screen_name):
+		"""Adds a user if it is not already in the graph, and returns its index
+
+		Args:
+			user_id: id of the user
+			name: name of the user
+			screen_name: screen_name of the user
+		"""
+		index = self._index.get(user_id)
+		if index is None:
+			index = len(self._ids)
+			self._index[user_id] = index
+			self._ids.append(user_id)
+			self._names += name.encode('utf-8')
+			self._name_offsets.append(len(self._names))
+			self._screen_names += screen_name.encode('utf-8')
+			self._screen_name_offsets.append(len(self._screen_names))
+		return index
+
+	def add_edge(self, src, dst, friends_or_followers):
+		"""Adds an edge, meaning dst is a friend/follower of src. Both users must
+		already be in the graph
+
+		Args:
+			src: id of the user being explored
+			dst: id of the friend/follower
+			friends_or_followers: 'friends' or 'followers'
+		"""
+		if friends_or_followers == 'friends':
+			self._edges.append(self._index[src] << 32 | self._index[dst])
+		else:
+			self._edges.append(self._index[dst] << 32 | self._index[src])
+		if len(self._edges) >= 2 * max(self._unique_edges, CrawlGraph._min_deduplicate):
+			self._deduplicate()
+
+	def _deduplicate(self):
+		"""Removes duplicate edges, leaving them sorted by row and then by column
+		"""
+		self._edges = array.array('q', np.unique(
+			np.frombuffer(self._edges, dtype=np.int64)).tobytes())
+		self._unique_edges = len(self._edges)
+
+	def index_of(self, user_id):
+		"""Returns the index of a user
+
+		Args:
+			user_id: id of the user
+		"""
+		return self._index[user_id]
+
+	def get_ids(self):
+		"""Returns the ids of all users as an int64 array, in index order
+		"""
+		return np.frombuffer(self._ids, dtype=np.int64).copy()
+
+	def get_edges(self):
+		"""Returns (rows, cols), int64 arrays of the indices of the distinct edges,
+		sorted by row and then by column. Row follows col
+		"""
+		keys = np.unique(np.frombuffer(self._edges, dtype=np.int64))
+		return keys >> 32, keys & 0xffffffff
+
+	def get_link_matrix(self):
+		"""Returns the link matrix of the graph in CSR form, indexed like the users
+		"""
+		rows, cols = self.get_edges()
+		return edges_to_csr(rows, cols, len(self._ids))
+
+	def get_adj_list(self):
+		"""Returns the adjacency list in the form saved by
+		DatasetFetcher.save_dataset, with every edge stored once, as a friend
+		"""
+		rows, cols = self.get_edges()
+		ids = self.get_ids()
+		friends = np.split(ids[cols], np.cumsum(np.bincount(rows, minlength=len(ids)))[:-1])
+		adj_list = {}
+		for index, user_id in enumerate(ids.tolist()):
+			adj_list[user_id] = {'friends': friends[index].tolist(), 'followers': []}
+		return adj_list
+
+	def __getitem__(self, user_id):
+		index = self._index[user_id]
+		return {
+			'name': self._names[
+				self._name_offsets[index]:self._name_offsets[index + 1]].decode('utf-8'),
+			'screen_name': self._screen_names[
+				self._screen_name_offsets[index]:self._screen_name_offsets[index + 1]
+			].decode('utf-8')
+		}
+
+	def __contains__(self, user_id):
+		return user_id in self._index
+
+	def __iter__(self):
+		return iter(self._ids)
+
+	def __len__(self):
+		return len(self._ids)
+
+def _json_value(value):
+	"""Returns a JSON serializable form of numpy scalars and arrays, for use
+	as the default of json.dumps
+	"""
+	if isinstance(value, np.generic):
+		return value.item()
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
 
 class Logger():
 	"""An instance of Logger can be used as a simple and intuitive interface
 	for logging
+
+	Records are put on a queue and written by a background thread, which
+	writes them out in batches and flushes the log file (and stdout) at most
+	once every flush_interval seconds, so logging never waits for I/O.
+	Besides messages, structured events (eg. throughput metrics) can be
+	logged, and the log file can be written as JSON lines
 	"""
 
-	def __init__(self, log_path, print_stdout=True, sep=' ', end='\n'):
+	def __init__(
+		self, log_path, print_stdout=True, sep=' ', end='\n', json_lines=False,
+		flush_interval=1.0, batch_size=1000):
 		"""Initializes an instance of Logger
 
 		Args:
@@ -20,11 +562,26 @@ class Logger():
 			print_stdout: True if the logs must be written to stdout
 			sep: string to be used to separate arguments of printing
 			end: string to be after the last argument of printing
+			json_lines: True if the log file is to hold one JSON object per
+			record instead of text. stdout always gets text
+			flush_interval: Maximum number of seconds a record waits before it
+			is written out
+			batch_size: Number of records after which a batch is written out
+			without waiting for flush_interval
 		"""
 		self._log_file = open(log_path, 'w')
 		self._print_stdout = print_stdout
 		self._sep = sep
 		self._end = end
+		self._json_lines = json_lines
+		self._flush_interval = flush_interval
+		self._batch_size = batch_size
+		self._queue = queue.Queue()
+		self._closed = False
+		self._thread = threading.Thread(target=self._write_records, daemon=True)
+		self._thread.start()
+		# Unregistered by close, so that closed loggers can be collected
+		atexit.register(self.close)
 
 	def log(self, *args):
 		"""Logs whatever is present in args with current date and time
@@ -37,26 +594,305 @@ class Logger():
 		Args:
 			args: List of elements to be logged
 		"""
-		to_print = str(dt.now()) + ': '
-		for i in args:
-			to_print += self._sep + str(i)
-		self._log_file.write(to_print + self._end)
+		self._queue.put((dt.now(), None, ''.join(self._sep + str(i) for i in args)))
+
+	def event(self, name, **fields):
+		"""Logs a structured record with current date and time
+
+		Args:
+			name: Name of the event
+			fields: Values of the event, which must be JSON serializable (numpy
+			scalars and arrays are converted)
+
+		Raises:
+			TypeError: A value can not be serialized
+		"""
+		# Serialized here, so that bad values raise in the caller rather than
+		# on the background thread
+		self._queue.put((dt.now(), name, json.dumps(fields, default=_json_value)))
+
+	def _format(self, record):
+		"""Returns (text, line of the log file) of a record
+		"""
+		now, name, value = record
+		if name is None:
+			text = str(now) + ': ' + value
+		else:
+			text = str(now) + ': ' + self._sep + name + self._sep + value
+		if not self._json_lines:
+			return text, text + self._end
+		if name is None:
+			return text, json.dumps({'time': now.isoformat(), 'message': value[len(self._sep):]}) + '\n'
+		line = json.dumps({'time': now.isoformat(), 'event': name})
+		if value != '{}':
+			# Splice the serialized fields into the object
+			line = line[:-1] + ', ' + value[1:]
+		return text, line + '\n'
+
+	def _write(self, batch):
+		"""Writes a batch of records out and flushes
+		"""
+		if not batch:
+			return
+		formatted = [self._format(record) for record in batch]
+		self._log_file.write(''.join(line for _, line in formatted))
 		self._log_file.flush()
 		if self._print_stdout:
-			print(to_print, end=self._end)
+			sys.stdout.write(''.join(text + self._end for text, _ in formatted))
 			sys.stdout.flush()
 
+	def _write_records(self):
+		"""Writes queued records in batches until the logger is closed. Runs on
+		the background thread
+		"""
+		batch = []
+		waiting = []
+		next_flush = time.time() + self._flush_interval
+		running = True
+		while running:
+			try:
+				record = self._queue.get(timeout=max(next_flush - time.time(), 0))
+			except queue.Empty:
+				record = ()
+			if record is None:
+				running = False
+			elif isinstance(record, threading.Event):
+				waiting.append(record)
+			elif record:
+				batch.append(record)
+			if (not running or waiting or len(batch) >= self._batch_size
+				or time.time() >= next_flush):
+				try:
+					self._write(batch)
+				except Exception as e:
+					# A failed batch is reported and dropped, but must not stop
+					# the thread, or later records and flushes would wait forever
+					sys.stderr.write('Logger could not write %d records: %r\n' % (len(batch), e))
+				batch = []
+				for flushed in waiting:
+					flushed.set()
+				waiting = []
+				next_flush = time.time() + self._flush_interval
+
+	def flush(self):
+		"""Waits until every record logged so far has been written out
+		"""
+		if self._closed:
+			return
+		flushed = threading.Event()
+		self._queue.put(flushed)
+		while not flushed.wait(1.0):
+			if not self._thread.is_alive():
+				return
+
+	def close(self):
+		"""Writes out the remaining records and closes the log file
+		"""
+		if self._closed:
+			return
+		self._closed = True
+		atexit.unregister(self.close)
+		self._queue.put(None)
+		self._thread.join()
+		self._log_file.close()
+
 	def __del__(self):
 		"""Close the log file when no references to the instance remain
 		"""
-		self._log_file.close()
+		self.close()
+
+class CrawlMetrics():
+	"""An instance of CrawlMetrics keeps the throughput of a crawl: users and
+	edges found, API calls and time slept per endpoint, and the rate limit
+	left on each endpoint as reported by the headers of the API responses,
+	so that no extra rate_limit_status calls are needed
+	"""
+
+	def __init__(self):
+		"""Initializes an instance of CrawlMetrics
+		"""
+		self._lock = threading.Lock()
+		self.start()
+
+	def start(self):
+		"""Starts counting afresh
+		"""
+		with self._lock:
+			self._start = time.time()
+			self.users = 0
+			self.edges = 0
+			self.api_calls = {'friends': 0, 'followers': 0}
+			self.sleep_time = {'friends': 0, 'followers': 0}
+			self.remaining = {}
+			self.reset = {}
+
+	@staticmethod
+	def rate_limit(response):
+		"""Returns (remaining, reset) from the x-rate-limit headers of an API
+		response, where reset is the epoch time at which the limit is reset, or
+		None if the response has no such headers
+
+		Args:
+			response: The HTTP response, eg. api.last_response or the response
+			of a tweepy.TweepError
+		"""
+		headers = getattr(response, 'headers', None)
+		if not headers:
+			return None
+		try:
+			return int(headers['x-rate-limit-remaining']), int(headers['x-rate-limit-reset'])
+		except (KeyError, TypeError, ValueError):
+			return None
+
+	def add_user(self):
+		"""Counts a visited user
+		"""
+		with self._lock:
+			self.users += 1
+
+	def add_edge(self):
+		"""Counts a recorded edge
+		"""
+		with self._lock:
+			self.edges += 1
+
+	def api_call(self, endpoint, response=None):
+		"""Counts a call to an endpoint and records the rate limit reported by
+		its response
+
+		Args:
+			endpoint: 'friends' or 'followers'
+			response: The HTTP response of the call, if known
+		"""
+		limit = CrawlMetrics.rate_limit(response)
+		with self._lock:
+			self.api_calls[endpoint] += 1
+			if limit is not None:
+				self.remaining[endpoint], self.reset[endpoint] = limit
+
+	def slept(self, endpoint, seconds):
+		"""Counts time slept waiting for the rate limit of an endpoint
+		"""
+		with self._lock:
+			self.sleep_time[endpoint] += seconds
+
+	def snapshot(self):
+		"""Returns the metrics, with rates per minute, as a dictionary
+		"""
+		with self._lock:
+			minutes = max(time.time() - self._start, 1e-9) / 60
+			return {
+				'seconds': minutes * 60,
+				'users': self.users,
+				'edges': self.edges,
+				'users_per_min': self.users / minutes,
+				'edges_per_min': self.edges / minutes,
+				'api_calls': dict(self.api_calls),
+				'api_calls_per_min': sum(self.api_calls.values()) / minutes,
+				'sleep_time': dict(self.sleep_time),
+				'remaining': dict(self.remaining)
+			}
+
+TwitterUser = collections.namedtuple('TwitterUser', ['id', 'name', 'screen_name'])
+
+class ResponseCache():
+	"""An instance of ResponseCache stores pages of friends/followers fetched
+	from the API in an SQLite database, keyed by endpoint, user and cursor, so
+	that re-crawls (and overlapping crawls) do not spend rate limit on them
+	again. Pages expire after a time to live, and the oldest pages are evicted
+	when the cache grows beyond a maximum number of pages
+	"""
+
+	def __init__(self, cache_path, ttl=7 * 24 * 60 * 60, max_pages=10 ** 6):
+		"""Initializes an instance of ResponseCache, creating the database if
+		needed
+
+		Args:
+			cache_path: Path to the SQLite database
+			ttl: Seconds after which a page is fetched again
+			max_pages: Maximum number of pages to keep
+		"""
+		self._ttl = ttl
+		self._max_pages = max_pages
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+		self._connection.execute(
+			'CREATE TABLE IF NOT EXISTS pages (endpoint TEXT, user_id INTEGER, '
+			'cursor INTEGER, fetched REAL, next_cursor INTEGER, users TEXT, '
+			'PRIMARY KEY (endpoint, user_id, cursor))')
+		self._connection.execute(
+			'CREATE INDEX IF NOT EXISTS pages_fetched ON pages (fetched)')
+		self._connection.commit()
+		self._puts = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, endpoint, user_id, cursor):
+		"""Returns (users, next_cursor) of a cached page, or None if the page is
+		not cached or has expired
+
+		Args:
+			endpoint: 'friends' or 'followers'
+			user_id: id of the user
+			cursor: Cursor of the page
+		"""
+		with self._lock:
+			row = self._connection.execute(
+				'SELECT next_cursor, users FROM pages WHERE endpoint = ? AND '
+				'user_id = ? AND cursor = ? AND fetched >= ?',
+				(endpoint, user_id, cursor, time.time() - self._ttl)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+		return [TwitterUser(*user) for user in json.loads(row[1])], row[0]
+
+	def put(self, endpoint, user_id, cursor, users, next_cursor):
+		"""Stores a page, evicting the oldest pages if the cache is full
+
+		Args:
+			endpoint: 'friends' or 'followers'
+			user_id: id of the user
+			cursor: Cursor of the page
+			users: List of TwitterUsers of the page
+			next_cursor: Cursor of the next page
+		"""
+		with self._lock:
+			self._connection.execute(
+				'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+				(endpoint, user_id, cursor, time.time(), next_cursor,
+				json.dumps([list(user) for user in users])))
+			self._puts += 1
+			# Checking the size on every put would double the cost of a put
+			if self._puts % 1000 == 0:
+				self._evict()
+			self._connection.commit()
+
+	def _evict(self):
+		"""Deletes expired pages, and the oldest pages beyond max_pages
+		"""
+		self._connection.execute(
+			'DELETE FROM pages WHERE fetched < ?', (time.time() - self._ttl,))
+		count = self._connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+		if count > self._max_pages:
+			self._connection.execute(
+				'DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages '
+				'ORDER BY fetched LIMIT ?)', (count - self._max_pages,))
+
+	def close(self):
+		"""Closes the database
+		"""
+		with self._lock:
+			self._evict()
+			self._connection.commit()
+			self._connection.close()
 
 class DatasetFetcher():
 	"""An instance of DatasetFetcher is used to obtain the dataset from
 	the internet
 	"""
 
-	def __init__(self, key, secret, logger):
+	def __init__(self, key, secret, logger, cache=None, api=None):
 		"""Initializes an instance of DatasetFetcher
 
 		Args:
@@ -64,55 +900,226 @@ class DatasetFetcher():
 			secret: secret to be used for authentication
 			logger: An instance of Logger to be used for logging purposed by public
 			member functions
+			cache: An instance of ResponseCache to reuse pages fetched earlier
+			api: API object to use instead of creating one from key and secret
+			(eg. a FakeTwitterAPI to crawl a local graph). It must provide
+			get_user, friends, followers and rate_limit_status like tweepy.API
 		"""
-		auth = tweepy.AppAuthHandler(key, secret)
-		self._api = tweepy.API(auth, retry_count=5)
-		self._visited = None
+		if api is None:
+			auth = tweepy.AppAuthHandler(key, secret)
+			api = tweepy.API(auth, retry_count=5)
+		self._api = api
 		self._graph = None
+		self._journal = None
+		self._checkpoint_path = ''
+		self._phase = None
+		self._popped = 0
+		self._cache = cache
 		self._logger = logger
+		self._metrics = CrawlMetrics()
 
 	def _print_api_rem(self):
-		"""Print remaining quota for friends listing and followers listing endpoints
+		"""Print remaining quota for friends listing and followers listing
+		endpoints, as reported by the headers of the last responses
 		"""
-		try:
-			temp = self._api.rate_limit_status()
-		except tweepy.RateLimitError:
-			self._logger.log('Rate limit API limit reached')
-		except Exception as e:
-			self._logger.log('API limit exception: ', repr(e))
+		if 'friends' in self._metrics.remaining:
+			self._logger.log('Friends endpoint remaining: ', self._metrics.remaining['friends'])
+		if 'followers' in self._metrics.remaining:
+			self._logger.log('Followers endpoint remaining: ', self._metrics.remaining['followers'])
+
+	def _wait_for_limit(self, friends_or_followers, response=None):
+		"""Sleeps until the rate limit of an endpoint is reset
+
+		Args:
+			friends_or_followers: 'friends' or 'followers'
+			response: The response that hit the limit. Its headers give the reset
+			time, which is otherwise asked for with rate_limit_status
+		"""
+		limit = CrawlMetrics.rate_limit(response)
+		if limit is not None:
+			seconds = max(limit[1] - time.time() + 1, 1)
 		else:
-			self._logger.log('Friends endpoint remaining: ',
-				temp['resources']['friends']['/friends/list']['remaining'])
-			self._logger.log('Followers endpoint remaining: ',
-				temp['resources']['followers']['/followers/list']['remaining'])
+			try:
+				reset_time = self._api.rate_limit_status()['resources'][friends_or_followers]['/' + friends_or_followers + '/list']['reset']
+			except tweepy.RateLimitError:
+				seconds = 15 * 60
+			except Exception as e:
+				self._logger.log('Unexpected exception thrown: ', repr(e))
+				seconds = 15 * 60
+			else:
+				seconds = max(reset_time - time.time() + 1, 1)
+		self._logger.log('Sleeping for', seconds, 'seconds')
+		self._metrics.slept(friends_or_followers, seconds)
+		time.sleep(seconds)
+
+	def _fetch_page(self, user_id, friends_or_followers, cursor):
+		"""Returns (users, next_cursor) of one page of friends/followers of a
+		user, from the cache if possible, or None if the page can not be fetched.
+		Waits for the rate limit to be reset if it is hit
 
-	def _handle_limit(self, cursor, friends_or_followers):
-		"""Handles rate limits given a cursor
+		Args:
+			user_id: id of the user
+			friends_or_followers: 'friends' or 'followers'
+			cursor: Cursor of the page, -1 for the first page
 		"""
+		if self._cache is not None:
+			page = self._cache.get(friends_or_followers, user_id, cursor)
+			if page is not None:
+				return page
 		while True:
 			try:
-				yield cursor.next()
-			except tweepy.RateLimitError:
-				try:
-					reset_time = self._api.rate_limit_status()['resources'][friends_or_followers]['/' + friends_or_followers + '/list']['reset']
-				except tweepy.RateLimitError:
-					self._logger.log('Sleeping for', 15 * 60, 'seconds')
-					time.sleep(15 * 60)
-				except Exception as e:
-					self._logger.log('Unexpected exception thrown: ', repr(e))
-					self._logger.log('Sleeping for', 15 * 60, 'seconds')
-					time.sleep(15 * 60)
-				else:
-					self._logger.log('Sleeping for', max(reset_time - time.time() + 1, 1), 'seconds')
-					time.sleep(max(reset_time - time.time() + 1, 1))
+				page, (_, next_cursor) = getattr(self._api, friends_or_followers)(
+					user_id=user_id, cursor=cursor, count=200)
+			except tweepy.RateLimitError as e:
+				self._metrics.api_call(friends_or_followers, getattr(e, 'response', None))
+				self._wait_for_limit(friends_or_followers, getattr(e, 'response', None))
 			except tweepy.TweepError as e:
+				self._metrics.api_call(friends_or_followers, getattr(e, 'response', None))
 				self._logger.log('tweepy.TweepError: code:', repr(e))
-				break
+				return None
+			else:
+				self._metrics.api_call(
+					friends_or_followers, getattr(self._api, 'last_response', None))
+				users = [TwitterUser(u.id, u.name, u.screen_name) for u in page]
+				if self._cache is not None:
+					self._cache.put(friends_or_followers, user_id, cursor, users, next_cursor)
+				return users, next_cursor
+
+	def _fetch_users(self, user_id, friends_or_followers, limit, start=None):
+		"""Yields up to limit friends/followers of a user, fetching a page at a
+		time. A checkpoint is written before each page after the first, when all
+		users of the earlier pages have been processed
+
+		Args:
+			user_id: id of the user
+			friends_or_followers: 'friends' or 'followers'
+			limit: Maximum number of users to yield
+			start: Checkpointed progress ({'cursor', 'count'}) to continue from
+			instead of the first page
+		"""
+		cnt = 0
+		cursor = -1
+		if start is not None:
+			cnt = start['count']
+			cursor = start['cursor']
+		first = True
+		while cursor != 0 and cnt < limit:
+			if not first:
+				self._checkpoint({
+					'user_id': user_id,
+					'endpoint': friends_or_followers,
+					'cursor': cursor,
+					'count': cnt
+				})
+			first = False
+			page = self._fetch_page(user_id, friends_or_followers, cursor)
+			if page is None:
+				return
+			users, cursor = page
+			for user in users[:limit - cnt]:
+				cnt += 1
+				yield user
+
+	def _log_progress(self):
+		"""Logs the hits and misses of the response cache, if there is one, and
+		the throughput of the crawl as a structured event
+		"""
+		if self._cache is not None:
+			self._logger.log('Cache hits:', self._cache.hits, 'misses:', self._cache.misses)
+		self._logger.event('throughput', **self._metrics.snapshot())
 
+	def _visit(self, user):
+		"""Marks a user as visited (but not explored) and records its info
+
+		Args:
+			user: User object with id, name and screen_name attributes
+		"""
+		self._graph.add_user(user.id, user.name, user.screen_name)
+		self._metrics.add_user()
+		if self._journal is not None:
+			self._journal.add_user(user.id, user.name, user.screen_name)
+
+	def _add_edge(self, user_id, other_id, friends_or_followers):
+		"""Records that other_id is a friend/follower of user_id. Both users
+		must have been visited
+
+		Args:
+			user_id: id of the user being explored
+			other_id: id of the friend/follower
+			friends_or_followers: 'friends' or 'followers'
+		"""
+		self._graph.add_edge(user_id, other_id, friends_or_followers)
+		self._metrics.add_edge()
+		if self._journal is not None:
+			self._journal.add_edge(user_id, other_id, friends_or_followers)
+
+	def _checkpoint(self, current=None):
+		"""Saves the state of the crawl, if checkpoints are enabled
+
+		The users and edges found are already in the journal, and the bfs
+		frontier is the list of visited users (in the order in which they were
+		visited) without the first self._popped, so only the phase, the number
+		of users popped, the journal length and the progress in the user being
+		explored are saved. The file is replaced atomically
+
+		Args:
+			current: Progress in the user being explored, if any
+		"""
+		if self._checkpoint_path == '':
+			return
+		self._journal.flush()
+		state = {
+			'version': 1,
+			'phase': self._phase,
+			'popped': self._popped,
+			'journal_offset': self._journal.tell(),
+			'current': current
+		}
+		temp_path = self._checkpoint_path + '.tmp'
+		with open(temp_path, 'wb') as f:
+			pickle.dump(state, f)
+		os.replace(temp_path, self._checkpoint_path)
+
+	def _resume(self, journal_path, checkpoint_path):
+		"""Restores the state of a crawl from its journal and checkpoint, and
+		returns (boundary, current)
+
+		Args:
+			journal_path: Path to the journal of the crawl
+			checkpoint_path: Path to the checkpoint of the crawl
+		"""
+		with open(checkpoint_path, 'rb') as f:
+			state = pickle.load(f)
+		if state['version'] != 1:
+			raise ValueError('Unknown checkpoint version in ' + checkpoint_path)
+		self._graph = EdgeJournal.read_graph(journal_path, end=state['journal_offset'])
+		# Anything written after the checkpoint is written again
+		self._journal = EdgeJournal(journal_path, resume_offset=state['journal_offset'])
+		self._phase = state['phase']
+		self._popped = state['popped']
+
+		boundary = queue.Queue()
+		for user_id in self._graph.get_ids()[self._popped:].tolist():
+			boundary.put(user_id)
+		self._logger.log('Resumed', self._phase, 'phase with', len(self._graph),
+			'users visited and', self._popped, 'explored')
+		return boundary, state['current']
+
+	def _next_user(self, boundary, current):
+		"""Returns (user_id, start) of the next user to explore: the user being
+		explored at the checkpoint if there is one, or else the next user of the
+		frontier
+		"""
+		self._logger.log('')
+		if current is not None:
+			return current['user_id'], current
+		self._print_api_rem()
+		self._popped += 1
+		return boundary.get(), None
 
 	def get_dataset(
 		self, seed_user, friends_limit, followers_limit, limit, live_save,
-		users_path, adj_list_path):
+		journal_path, checkpoint_path='', resume=False):
 		"""Obtain the dataset
 
 			Args:
@@ -120,76 +1127,70 @@ class DatasetFetcher():
 			friends_limit: Maximum number of friends to consider for each user
 			followers_limit: Maximum number of followers to consider for each user
 			limit: Maximum number of users to find friends and followers of
-			live_save: Whether to save computed data frequently
-			users_path: Path to the file where the users info will be stored
-
-			adj_list_path:
+			live_save: Whether to save computed data as it is found
+			journal_path: Path to the journal (see EdgeJournal) that users and
+			edges are appended to when live_save is True
+			checkpoint_path: Path to the file where the state of the crawl is
+			checkpointed after every page, when live_save is True
+			resume: True if the crawl is to be continued from the checkpoint at
+			checkpoint_path (and its journal) instead of starting at seed_user
 		"""
 
 		# Each node has three possible states -
 		# unvisited, visited but not explored, explored
 
-		# each key-value pair is of the form
-		# id: {'name': '', 'screen_name': ''}
-		# serves two purposes -
-		#   ids in this are those that are visited
-		#   stores user info corresponding to each id
-		self._visited = {}
+		# Only new users and edges are written, so saving costs O(new data)
+		# rather than O(everything crawled so far)
+		self._checkpoint_path = checkpoint_path if live_save else ''
+		self._metrics.start()
 
-		# each key-value pair is of the form
-		# id: {'friends': [], 'followers': []}
-		# set of ids in graph equal to set of ids in visited
-		self._graph = {}
+		if resume:
+			boundary, current = self._resume(journal_path, checkpoint_path)
+		else:
+			# Users in the graph are those that are visited, in the order in
+			# which they were visited, along with their info and the edges
+			# found between them
+			self._graph = CrawlGraph()
 
-		# ids that have been visited (and hence their info is in visited dict)
-		# but not yet explored
-		boundary = queue.Queue()
+			self._journal = EdgeJournal(journal_path) if live_save else None
+			self._phase = 'main'
+			self._popped = 0
+			current = None
 
-		# Initialise
-		seed_user = self._api.get_user(seed_user)
-		self._visited[seed_user.id] = {
-			'name': seed_user.name,
-			'screen_name': seed_user.screen_name
-		}
-		self._graph[seed_user.id] = {
-			'friends': [],
-			'followers': []
-		}
-		boundary.put(seed_user.id)
+			# ids that have been visited (and hence their info is in visited dict)
+			# but not yet explored
+			boundary = queue.Queue()
+
+			# Initialise
+			seed_user = self._api.get_user(seed_user)
+			self._visit(seed_user)
+			boundary.put(seed_user.id)
 
 		# Explore users as long as the total number of visited users is less than
 		# limit
-		should_break = False
-		live_save_suffix = 0
-		while True:
-			self._logger.log('')
-			self._print_api_rem()
-			user_id = boundary.get()
-			self._logger.log('Selected:', self._visited[user_id]['screen_name'],
-				',', self._visited[user_id]['name'], ',', user_id)
+		should_break = self._phase != 'main'
+		while not should_break:
+			user_id, start = self._next_user(boundary, current)
+			current = None
+			self._logger.log('Selected:', self._graph[user_id]['screen_name'],
+				',', self._graph[user_id]['name'], ',', user_id)
 
 			# Find friends
-			self._logger.log('Finding friends..')
-			cnt = 0
-			for friend in self._handle_limit(
-				tweepy.Cursor(self._api.friends, user_id=user_id).items(friends_limit), 'friends'):
+			if start is None or start['endpoint'] == 'friends':
+				self._logger.log('Finding friends..')
+				cnt = 0
+				for friend in self._fetch_users(user_id, 'friends', friends_limit, start):
 
-				cnt += 1
-				self._graph[user_id]['friends'].append(friend.id)
-				if friend.id not in self._visited:
-					self._visited[friend.id] = {
-						'name': friend.name,
-						'screen_name': friend.screen_name
-					}
-					self._graph[friend.id] = {
-						'friends': [],
-						'followers': []
-					}
-					boundary.put(friend.id)
-					if len(self._visited) >= limit:
-						should_break = True
+					cnt += 1
+					if friend.id not in self._graph:
+						self._visit(friend)
+						boundary.put(friend.id)
+						should_break = len(self._graph) >= limit
+					self._add_edge(user_id, friend.id, 'friends')
+					if should_break:
 						break
-			self._logger.log('Found', cnt, 'friends')
+				self._logger.log('Found', cnt, 'friends')
+				start = None
 
 			if should_break:
 				break
@@ -197,129 +1198,696 @@ class DatasetFetcher():
 			# Find followers
 			self._logger.log('Finding followers..')
 			cnt = 0
-			for follower in self._handle_limit(
-				tweepy.Cursor(self._api.followers, user_id=user_id).items(followers_limit), 'followers'):
+			for follower in self._fetch_users(user_id, 'followers', followers_limit, start):
 
 				cnt += 1
-				self._graph[user_id]['followers'].append(follower.id)
-				if follower.id not in self._visited:
-					self._visited[follower.id] = {
-						'name': follower.name,
-						'screen_name': follower.screen_name
-					}
-					self._graph[follower.id] = {
-						'friends': [],
-						'followers': []
-					}
+				if follower.id not in self._graph:
+					self._visit(follower)
 					boundary.put(follower.id)
-					if len(self._visited) >= limit:
-						should_break = True
-						break
+					should_break = len(self._graph) >= limit
+				self._add_edge(user_id, follower.id, 'followers')
+				if should_break:
+					break
 			self._logger.log('Found', cnt, 'followers')
-
-			self._logger.log('Latest save suffix: ', live_save_suffix % 2)
-			if live_save:
-				self.save_dataset(users_path + str(live_save_suffix % 2), adj_list_path + str(live_save_suffix % 2))
-			live_save_suffix += 1
-
-			if should_break:
-				break
+			self._log_progress()
+			self._checkpoint()
 
 		# Number of visited users is now equal to limit. Now find friends and
 		# followers of visited but unexplored users. Among these, consider only
 		# those that have already been visited, thus not increasing the number
 		# of users visited
+		if self._phase == 'main':
+			self._phase = 'boundary'
+			self._checkpoint()
 		self._logger.log('')
 		self._logger.log('Boundary..')
-		while not boundary.empty():
-			self._logger.log('')
-			self._print_api_rem()
-			user_id = boundary.get()
-			self._logger.log('Selected:', self._visited[user_id]['screen_name'],
-				',', self._visited[user_id]['name'], ',', user_id)
+		while current is not None or not boundary.empty():
+			user_id, start = self._next_user(boundary, current)
+			current = None
+			self._logger.log('Selected:', self._graph[user_id]['screen_name'],
+				',', self._graph[user_id]['name'], ',', user_id)
 
 			# Find friends
-			self._logger.log('Finding friends..')
-			cnt = 0
-			cnt2 = 0
-			for friend in self._handle_limit(
-				tweepy.Cursor(self._api.friends, user_id=user_id).items(friends_limit), 'friends'):
+			if start is None or start['endpoint'] == 'friends':
+				self._logger.log('Finding friends..')
+				cnt = 0
+				cnt2 = 0
+				for friend in self._fetch_users(user_id, 'friends', friends_limit, start):
 
-				cnt += 1
-				if friend.id in self._visited:
-					cnt2 += 1
-					self._graph[user_id]['friends'].append(friend.id)
-			self._logger.log('Found', cnt, 'friends')
-			self._logger.log('Used', cnt2, 'friends')
+					cnt += 1
+					if friend.id in self._graph:
+						cnt2 += 1
+						self._add_edge(user_id, friend.id, 'friends')
+				self._logger.log('Found', cnt, 'friends')
+				self._logger.log('Used', cnt2, 'friends')
+				start = None
 
 			# Find followers
 			self._logger.log('Finding followers..')
 			cnt = 0
 			cnt2 = 0
-			for follower in self._handle_limit(
-				tweepy.Cursor(self._api.followers, user_id=user_id).items(followers_limit), 'followers'):
+			for follower in self._fetch_users(user_id, 'followers', followers_limit, start):
 
 				cnt += 1
-				if follower.id in self._visited:
+				if follower.id in self._graph:
 					cnt2 += 1
-					self._graph[user_id]['followers'].append(follower.id)
+					self._add_edge(user_id, follower.id, 'followers')
 			self._logger.log('Found', cnt, 'followers')
 			self._logger.log('Used', cnt2, 'followers')
-
-			self._logger.log('Latest save suffix: ', live_save_suffix % 2)
-			if live_save:
-				self.save_dataset(users_path + str(live_save_suffix % 2),
-					adj_list_path + str(live_save_suffix % 2))
-			live_save_suffix += 1
+			self._log_progress()
+			self._checkpoint()
 
 			self._logger.log('Queue size:', boundary.qsize())
 
-	def save_dataset(self, users_path, adj_list_path):
+		# Closing compacts the journal, so the offsets in the checkpoint no
+		# longer hold. The crawl is complete, so there is nothing to resume, and
+		# the checkpoint is removed first so that it is never left referring to
+		# a compacted journal
+		if self._checkpoint_path != '' and os.path.exists(self._checkpoint_path):
+			os.remove(self._checkpoint_path)
+		if self._journal is not None:
+			self._journal.close()
+			self._journal = None
+
+	def save_dataset(self, users_path, adj_list_path, user_store_path=''):
 		"""Save the dataset obtained by get_dataset
 
+		The pickled users dictionary and adjacency list keep their usual form,
+		with every (deduplicated) edge stored once, as a friend. The crawl graph
+		itself can be converted without pickling by passing it to
+		ListToMatrixConverter through get_graph
+
 		Args:
 			users_path: Path to the file where users info will be stored
 			adj_list_path: Path to the file where the adjacency list will be stored
+			user_store_path: Path to the directory where users info will be stored
+			as a UserStore, in the order in which users were visited (which is
+			the link matrix order of ListToMatrixConverter)
 		"""
+		if user_store_path != '':
+			try:
+				UserStore.save(user_store_path, self._graph.get_ids(), self._graph)
+			except Exception as e:
+				self._logger.log('UserStore Exception:', repr(e))
+
 		if users_path != '':
 			with open(users_path, mode='wb') as f:
 				try:
-					pickle.dump(self._visited, f)
+					pickle.dump(dict(self._graph), f)
 				except Exception as e:
 					self._logger.log('adjException:', repr(e))
 
 		if adj_list_path != '':
 			with open(adj_list_path, mode='wb') as f:
 				try:
-					pickle.dump(self._graph, f)
+					pickle.dump(self._graph.get_adj_list(), f)
 				except Exception as e:
 					self._logger.log('dump Exception:', repr(e))
 
+	def get_graph(self):
+		"""Returns the CrawlGraph of the dataset obtained by get_dataset
+		"""
+		return self._graph
+
+	def get_metrics(self):
+		"""Returns the throughput of the last (or current) run of get_dataset, as
+		given by CrawlMetrics.snapshot
+		"""
+		return self._metrics.snapshot()
+
+class TokenBucket():
+	"""An instance of TokenBucket models the rate limit of one endpoint for one
+	credential. Tokens are refilled continuously at capacity per window
+	"""
+
+	def __init__(self, capacity, window):
+		"""Initializes an instance of TokenBucket with a full bucket
+
+		Args:
+			capacity: Maximum number of requests allowed per window
+			window: Length of the rate limit window in seconds
+		"""
+		self._capacity = capacity
+		self._rate = capacity / window
+		self._tokens = float(capacity)
+		self._last = time.monotonic()
+		self._blocked_until = 0
+
+	def _refill(self):
+		"""Adds the tokens earned since the last refill
+		"""
+		now = time.monotonic()
+		if now >= self._blocked_until:
+			start = max(self._last, self._blocked_until)
+			self._tokens = min(self._capacity, self._tokens + (now - start) * self._rate)
+		self._last = now
+
+	def try_acquire(self):
+		"""Takes a token if one is available. Returns True if a token was taken
+		"""
+		self._refill()
+		if self._tokens >= 1:
+			self._tokens -= 1
+			return True
+		return False
+
+	def wait_time(self):
+		"""Returns the number of seconds until a token will be available
+		"""
+		self._refill()
+		now = time.monotonic()
+		if now < self._blocked_until:
+			return self._blocked_until - now + 1 / self._rate
+		return max(0, (1 - self._tokens) / self._rate)
+
+	def exhaust(self, reset_in=None):
+		"""Empties the bucket, eg. when the API reports the limit was hit
+
+		Args:
+			reset_in: Seconds until the API resets the limit. If given, no tokens
+			are refilled before then
+		"""
+		self._tokens = 0
+		if reset_in is not None:
+			self._blocked_until = time.monotonic() + reset_in
+
+class CredentialPool():
+	"""An instance of CredentialPool hands out API objects (one per credential)
+	such that no credential exceeds its rate limit on any endpoint. One
+	TokenBucket is kept per credential and per endpoint, and a request is given
+	to any credential with quota left. The pool only sleeps when every
+	credential is out of quota for an endpoint
+	"""
+
+	def __init__(self, apis, logger, limits=None, window=15 * 60, metrics=None):
+		"""Initializes an instance of CredentialPool
+
+		Args:
+			apis: List of API objects, one per credential
+			logger: An instance of Logger
+			limits: Dictionary from endpoint ('friends'/'followers') to the
+			number of requests allowed per window for one credential
+			window: Length of the rate limit window in seconds
+			metrics: An instance of CrawlMetrics to count time slept in
+		"""
+		if limits is None:
+			limits = {'friends': 15, 'followers': 15}
+		self._apis = apis
+		self._logger = logger
+		self._buckets = [
+			{endpoint: TokenBucket(limits[endpoint], window) for endpoint in limits}
+			for _ in apis]
+		self._next = 0
+		self._lock = threading.Lock()
+		self.sleep_time = {endpoint: 0 for endpoint in limits}
+		self._metrics = metrics
+
+	def acquire(self, endpoint):
+		"""Returns (index, api) of a credential that may make a request to
+		endpoint, sleeping only if no credential has quota left
+
+		Args:
+			endpoint: 'friends' or 'followers'
+		"""
+		while True:
+			with self._lock:
+				# Round robin, so that load is spread over the credentials
+				for i in range(len(self._apis)):
+					index = (self._next + i) % len(self._apis)
+					if self._buckets[index][endpoint].try_acquire():
+						self._next = index + 1
+						return index, self._apis[index]
+				wait = min(buckets[endpoint].wait_time() for buckets in self._buckets)
+				self.sleep_time[endpoint] += wait
+			if self._metrics is not None:
+				self._metrics.slept(endpoint, wait)
+			self._logger.log('All credentials exhausted for', endpoint,
+				'. Sleeping for', wait, 'seconds')
+			time.sleep(wait)
+
+	def exhausted(self, index, endpoint, reset_in=None):
+		"""Marks a credential as out of quota for an endpoint
+
+		Args:
+			index: Index of the credential, as returned by acquire
+			endpoint: 'friends' or 'followers'
+			reset_in: Seconds until the API resets the limit, if known
+		"""
+		with self._lock:
+			self._buckets[index][endpoint].exhaust(reset_in)
+
+class ConcurrentDatasetFetcher(DatasetFetcher):
+	"""An instance of ConcurrentDatasetFetcher obtains the same dataset as
+	DatasetFetcher, but fetches the friends and followers of many users of the
+	bfs frontier at once, over several credentials
+	"""
+
+	def __init__(
+		self, credentials, logger, workers=8, apis=None, cache=None, limits=None,
+		window=15 * 60):
+		"""Initializes an instance of ConcurrentDatasetFetcher
+
+		Args:
+			credentials: List of (key, secret) pairs to be used for authentication
+			logger: An instance of Logger to be used for logging purposed by public
+			member functions
+			workers: Number of requests to make concurrently
+			apis: List of API objects to use instead of creating them from
+			credentials (eg. FakeTwitterAPIs to crawl a local graph)
+			cache: An instance of ResponseCache to reuse pages fetched earlier
+			limits: Dictionary from endpoint to the number of requests allowed
+			per window for one credential (see CredentialPool)
+			window: Length of the rate limit window in seconds
+		"""
+		if apis is None:
+			apis = [tweepy.API(tweepy.AppAuthHandler(key, secret), retry_count=5)
+				for key, secret in credentials]
+		self._api = apis[0]
+		self._metrics = CrawlMetrics()
+		self._pool = CredentialPool(apis, logger, limits, window, self._metrics)
+		self._workers = workers
+		self._cache = cache
+		self._graph = None
+		self._journal = None
+		self._logger = logger
+
+	def _fetch(self, user_id, friends_or_followers, limit):
+		"""Returns up to limit friends/followers of a user as TwitterUsers,
+		fetching page by page with whichever credential has quota
+
+		Args:
+			user_id: id of the user
+			friends_or_followers: 'friends' or 'followers'
+			limit: Maximum number of users to fetch
+		"""
+		users = []
+		cursor = -1
+		while cursor != 0 and len(users) < limit:
+			if self._cache is not None:
+				page = self._cache.get(friends_or_followers, user_id, cursor)
+				if page is not None:
+					users.extend(page[0])
+					cursor = page[1]
+					continue
+			index, api = self._pool.acquire(friends_or_followers)
+			cursor_fetched = cursor
+			try:
+				page, (_, cursor) = getattr(api, friends_or_followers)(
+					user_id=user_id, cursor=cursor, count=200)
+			except tweepy.RateLimitError as e:
+				# The reset time comes from the headers of this response, as
+				# last_response may already belong to another thread's request
+				response = getattr(e, 'response', None)
+				self._metrics.api_call(friends_or_followers, response)
+				rate_limit = CrawlMetrics.rate_limit(response)
+				self._pool.exhausted(index, friends_or_followers,
+					None if rate_limit is None else max(rate_limit[1] - time.time(), 1))
+				continue
+			except tweepy.TweepError as e:
+				self._metrics.api_call(friends_or_followers, getattr(e, 'response', None))
+				self._logger.log('tweepy.TweepError: code:', repr(e))
+				break
+			self._metrics.api_call(friends_or_followers)
+			page = [TwitterUser(u.id, u.name, u.screen_name) for u in page]
+			if self._cache is not None:
+				self._cache.put(friends_or_followers, user_id, cursor_fetched, page, cursor)
+			users.extend(page)
+		return users[:limit]
+
+	def _fetch_wave(self, executor, user_ids, friends_limit, followers_limit):
+		"""Returns {user_id: (friends, followers)} for a wave of users, fetched
+		concurrently
+
+		Args:
+			executor: Executor to run the requests on
+			user_ids: ids of the users of the wave
+			friends_limit: Maximum number of friends to consider for each user
+			followers_limit: Maximum number of followers to consider for each user
+		"""
+		futures = {}
+		for user_id in user_ids:
+			futures[user_id] = (
+				executor.submit(self._fetch, user_id, 'friends', friends_limit),
+				executor.submit(self._fetch, user_id, 'followers', followers_limit))
+		return {user_id: (futures[user_id][0].result(), futures[user_id][1].result())
+			for user_id in user_ids}
+
+	def _use_visited(self, user_id, friends, followers):
+		"""Records the edges of an explored user that lead to visited users, as
+		done for the boundary in DatasetFetcher.get_dataset
+		"""
+		for friends_or_followers, others in (('friends', friends), ('followers', followers)):
+			cnt2 = 0
+			for other in others:
+				if other.id in self._graph:
+					cnt2 += 1
+					self._add_edge(user_id, other.id, friends_or_followers)
+			self._logger.log('Found', len(others), friends_or_followers)
+			self._logger.log('Used', cnt2, friends_or_followers)
+
+	def get_dataset(
+		self, seed_user, friends_limit, followers_limit, limit, live_save,
+		journal_path):
+		"""Obtain the dataset. Takes the same arguments as
+		DatasetFetcher.get_dataset
+
+		Users are taken off the frontier in waves of up to workers users. The
+		friends and followers of a wave are fetched concurrently and then
+		processed in bfs order, so the dataset is the same as the one found by
+		DatasetFetcher.get_dataset
+		"""
+		self._graph = CrawlGraph()
+		self._journal = EdgeJournal(journal_path) if live_save else None
+		self._metrics.start()
+		boundary = queue.Queue()
+
+		seed_user = self._api.get_user(seed_user)
+		self._visit(seed_user)
+		boundary.put(seed_user.id)
+
+		with concurrent.futures.ThreadPoolExecutor(self._workers) as executor:
+			should_break = False
+			while not should_break and not boundary.empty():
+				wave = [boundary.get() for _ in range(min(self._workers, boundary.qsize()))]
+				found = self._fetch_wave(executor, wave, friends_limit, followers_limit)
+				for user_id in wave:
+					self._logger.log('')
+					self._logger.log('Selected:', self._graph[user_id]['screen_name'],
+						',', self._graph[user_id]['name'], ',', user_id)
+					friends, followers = found[user_id]
+					if should_break:
+						# The limit was reached earlier in this wave, so this user
+						# belongs to the boundary
+						self._use_visited(user_id, friends, followers)
+						continue
+
+					for friends_or_followers, others in (
+						('friends', friends), ('followers', followers)):
+						cnt = 0
+						for other in others:
+							cnt += 1
+							if other.id not in self._graph:
+								self._visit(other)
+								boundary.put(other.id)
+								should_break = len(self._graph) >= limit
+							self._add_edge(user_id, other.id, friends_or_followers)
+							if should_break:
+								break
+						self._logger.log('Found', cnt, friends_or_followers)
+						if should_break:
+							break
+				self._log_progress()
+
+			self._logger.log('')
+			self._logger.log('Boundary..')
+			while not boundary.empty():
+				wave = [boundary.get() for _ in range(min(self._workers, boundary.qsize()))]
+				found = self._fetch_wave(executor, wave, friends_limit, followers_limit)
+				for user_id in wave:
+					self._logger.log('')
+					self._logger.log('Selected:', self._graph[user_id]['screen_name'],
+						',', self._graph[user_id]['name'], ',', user_id)
+					self._use_visited(user_id, *found[user_id])
+				self._logger.log('Queue size:', boundary.qsize())
+				self._log_progress()
+
+		self._logger.log('Sleep time per endpoint:', self._pool.sleep_time)
+		if self._journal is not None:
+			self._journal.close()
+			self._journal = None
+
+class EdgeJournal():
+	"""An instance of EdgeJournal is an append-only binary log of the users and
+	edges found during a crawl
+
+	Records are buffered and written in batches, so saving costs O(new data)
+	instead of re-pickling the whole crawl. The file starts with MAGIC and
+	is followed by records of two kinds -
+		b'U' id name_length screen_name_length name screen_name
+		b'E' src dst kind
+	where ids are little-endian int64, lengths are uint16, names are UTF-8
+	and kind is 0 for friends and 1 for followers
+	"""
+
+	MAGIC = b'THJ1'
+	KINDS = ('friends', 'followers')
+
+	_user_struct = struct.Struct('<qHH')
+	_edge_struct = struct.Struct('<qqB')
+
+	def __init__(self, journal_path, batch_size=4096, compact_every=0, resume_offset=None):
+		"""Initializes an instance of EdgeJournal, creating a new (empty) journal
+
+		Args:
+			journal_path: Path to the journal file
+			batch_size: Number of records to buffer before writing them out
+			compact_every: Compact the journal after this many batches have been
+			written. 0 compacts only when the journal is closed. Compaction moves
+			records, so it must stay 0 while checkpoints refer to offsets in the
+			journal
+			resume_offset: If given, the existing journal is cut to this many
+			bytes and appended to, instead of creating a new journal
+		"""
+		self._path = journal_path
+		self._batch_size = batch_size
+		self._compact_every = compact_every
+		self._buffer = bytearray()
+		self._buffered = 0
+		self._batches = 0
+		if resume_offset is not None:
+			self._file = open(journal_path, 'r+b')
+			self._file.truncate(resume_offset)
+			self._file.seek(resume_offset)
+		else:
+			self._file = open(journal_path, 'wb')
+			self._file.write(EdgeJournal.MAGIC)
+
+	def add_user(self, user_id, name, screen_name):
+		"""Appends a newly visited user
+
+		Args:
+			user_id: id of the user
+			name: name of the user
+			screen_name: screen_name of the user
+		"""
+		name = name.encode('utf-8')
+		screen_name = screen_name.encode('utf-8')
+		self._buffer += b'U'
+		self._buffer += EdgeJournal._user_struct.pack(
+			user_id, len(name), len(screen_name))
+		self._buffer += name
+		self._buffer += screen_name
+		self._added()
+
+	def add_edge(self, src, dst, friends_or_followers):
+		"""Appends an edge, meaning dst is a friend/follower of src
+
+		Args:
+			src: id of the user being explored
+			dst: id of the friend/follower
+			friends_or_followers: 'friends' or 'followers'
+		"""
+		self._buffer += b'E'
+		self._buffer += EdgeJournal._edge_struct.pack(
+			src, dst, EdgeJournal.KINDS.index(friends_or_followers))
+		self._added()
+
+	def _added(self):
+		"""Writes the buffer out once a full batch has been collected
+		"""
+		self._buffered += 1
+		if self._buffered >= self._batch_size:
+			self.flush()
+			self._batches += 1
+			if self._compact_every and self._batches % self._compact_every == 0:
+				self.compact()
+
+	def flush(self):
+		"""Writes all buffered records to the journal file
+		"""
+		if self._buffered:
+			self._file.write(self._buffer)
+			self._buffer = bytearray()
+			self._buffered = 0
+		self._file.flush()
+
+	def tell(self):
+		"""Returns the length in bytes of the journal written so far (not
+		counting buffered records)
+		"""
+		return self._file.tell()
+
+	def compact(self):
+		"""Rewrites the journal without duplicate users and edges
+
+		The rewritten journal is written to a temporary file that atomically
+		replaces the journal, so a crash never leaves a partial journal behind
+		"""
+		self.flush()
+		self._file.close()
+		users, adj_list = EdgeJournal.read(self._path)
+		temp_path = self._path + '.tmp'
+		with open(temp_path, 'wb') as f:
+			f.write(EdgeJournal.MAGIC)
+			for user_id in users:
+				name = users[user_id]['name'].encode('utf-8')
+				screen_name = users[user_id]['screen_name'].encode('utf-8')
+				f.write(b'U' + EdgeJournal._user_struct.pack(
+					user_id, len(name), len(screen_name)) + name + screen_name)
+			for src in adj_list:
+				for kind, friends_or_followers in enumerate(EdgeJournal.KINDS):
+					for dst in dict.fromkeys(adj_list[src][friends_or_followers]):
+						f.write(b'E' + EdgeJournal._edge_struct.pack(src, dst, kind))
+		os.replace(temp_path, self._path)
+		self._file = open(self._path, 'ab')
+
+	def close(self):
+		"""Writes out remaining records, compacts and closes the journal
+		"""
+		self.compact()
+		self._file.close()
+
+	@staticmethod
+	def _records(journal_path, end=None):
+		"""Yields the records of a journal, as (b'U', id, name, screen_name) or
+		(b'E', src, dst, kind)
+
+		A record cut short at the end of the file (eg. by a crash) is ignored
+
+		Args:
+			journal_path: Path to the journal file
+			end: If given, only the first end bytes of the journal are read
+		"""
+		with open(journal_path, 'rb') as f:
+			data = f.read() if end is None else f.read(end)
+		if data[:len(EdgeJournal.MAGIC)] != EdgeJournal.MAGIC:
+			raise ValueError('Not a journal: ' + journal_path)
+
+		user_size = EdgeJournal._user_struct.size
+		edge_size = EdgeJournal._edge_struct.size
+		pos = len(EdgeJournal.MAGIC)
+		while pos < len(data):
+			tag = data[pos:pos + 1]
+			pos += 1
+			if tag == b'U':
+				if pos + user_size > len(data):
+					break
+				user_id, name_len, screen_name_len = \
+					EdgeJournal._user_struct.unpack_from(data, pos)
+				pos += user_size
+				if pos + name_len + screen_name_len > len(data):
+					break
+				name = data[pos:pos + name_len].decode('utf-8')
+				pos += name_len
+				screen_name = data[pos:pos + screen_name_len].decode('utf-8')
+				pos += screen_name_len
+				yield tag, user_id, name, screen_name
+			elif tag == b'E':
+				if pos + edge_size > len(data):
+					break
+				src, dst, kind = EdgeJournal._edge_struct.unpack_from(data, pos)
+				pos += edge_size
+				yield tag, src, dst, kind
+			else:
+				raise ValueError('Corrupt journal record at byte ' + str(pos - 1))
+
+	@staticmethod
+	def read(journal_path, end=None):
+		"""Returns the users dictionary and the adjacency list stored in a journal
+
+		Both have the same form as those saved by DatasetFetcher.save_dataset.
+		A record cut short at the end of the file (eg. by a crash) is ignored
+
+		Args:
+			journal_path: Path to the journal file
+			end: If given, only the first end bytes of the journal are read
+		"""
+		users = {}
+		adj_list = {}
+		for record in EdgeJournal._records(journal_path, end):
+			if record[0] == b'U':
+				_, user_id, name, screen_name = record
+				if user_id not in users:
+					users[user_id] = {'name': name, 'screen_name': screen_name}
+					adj_list[user_id] = {'friends': [], 'followers': []}
+			else:
+				_, src, dst, kind = record
+				adj_list[src][EdgeJournal.KINDS[kind]].append(dst)
+		return users, adj_list
+
+	@staticmethod
+	def read_graph(journal_path, end=None):
+		"""Returns the CrawlGraph stored in a journal. Takes the same arguments as
+		read
+		"""
+		graph = CrawlGraph()
+		# Edges are added once all users are known, since journals written
+		# before users were visited ahead of their edges may have an edge
+		# before the user it leads to
+		srcs = array.array('q')
+		dsts = array.array('q')
+		kinds = array.array('b')
+		for record in EdgeJournal._records(journal_path, end):
+			if record[0] == b'U':
+				graph.add_user(*record[1:])
+			else:
+				srcs.append(record[1])
+				dsts.append(record[2])
+				kinds.append(record[3])
+		for src, dst, kind in zip(srcs, dsts, kinds):
+			graph.add_edge(src, dst, EdgeJournal.KINDS[kind])
+		return graph
+
 class ListToMatrixConverter():
 	"""An instance of ListToMatrixConverter is used to convert the data obtained
 	by the dataset fetcher from adjacency list form to a matrix form (and an
 	index-to-userid map)
 	"""
 
-	def __init__(self, adj_list_path):
+	def __init__(self, adj_list_path='', is_journal=False, graph=None):
 		"""Initializes an instance of ListToMatrixConverter
 
 		Args:
 			adj_list_path: Path to the file where the adjacency list is stored
+			is_journal: True if adj_list_path is a journal written by
+			EdgeJournal rather than a pickled adjacency list
+			graph: A CrawlGraph (eg. from DatasetFetcher.get_graph) to convert
+			instead of reading adj_list_path
 		"""
-		with open(adj_list_path, 'rb') as f:
-			self._adj_list = pickle.load(f)
+		self._adj_list = None
+		self._graph = graph
+		if graph is None and is_journal:
+			self._graph = EdgeJournal.read_graph(adj_list_path)
+		elif graph is None:
+			with open(adj_list_path, 'rb') as f:
+				self._adj_list = pickle.load(f)
+		# Details of the users, if known
+		self._users = self._graph
 		self._link_matrix = None
 		self._index_id_map = None
+		self._ordering = None
 
-	def convert(self):
+	def convert(self, ordering=None):
 		"""Use the adjacency list to create the link matrix and a dictionary that
 		maps the index in the link matrix to a user id
-		"""
 
-		# Put contents of self._adj_list in a matrix
-		size = len(self._adj_list)
-		self._link_matrix = np.zeros((size, size), dtype=np.int)
+		The link matrix is built directly in sparse (CSR) form from the edges of
+		the adjacency list, so memory and time are O(number of edges). Duplicate
+		edges (eg. an edge seen both as a friend and as a follower) are stored
+		only once. A dense matrix is only created by save when asked for. A
+		CrawlGraph is already indexed, so its edges are used as they are
+
+		Args:
+			ordering: Ordering of the users in the link matrix, one of ORDERINGS
+			(see node_order). By default users are in crawl order
+		"""
+		if ordering not in ORDERINGS:
+			raise ValueError('Unknown ordering: ' + str(ordering))
+		if self._graph is not None:
+			self._link_matrix = self._graph.get_link_matrix()
+			self._index_id_map = dict(enumerate(self._graph.get_ids().tolist()))
+			self._reorder(ordering)
+			return
 
 		# Create map to save some time
 		id_index_map = {}
@@ -328,42 +1896,185 @@ class ListToMatrixConverter():
 			id_index_map[user_id] = index
 			index += 1
 
+		# Collect the edges as (row, col) pairs in typed arrays
+		rows = array.array('q')
+		cols = array.array('q')
 		for user_id in self._adj_list:
+			user_index = id_index_map[user_id]
 			for friend_id in self._adj_list[user_id]['friends']:
-				self._link_matrix[id_index_map[user_id], id_index_map[friend_id]] = 1
+				rows.append(user_index)
+				cols.append(id_index_map[friend_id])
 			for follower_id in self._adj_list[user_id]['followers']:
-				self._link_matrix[id_index_map[follower_id], id_index_map[user_id]] = 1
+				rows.append(id_index_map[follower_id])
+				cols.append(user_index)
+
+		self._link_matrix = edges_to_csr(rows, cols, len(id_index_map))
 
 		self._index_id_map = {}
 		for i in id_index_map:
 			self._index_id_map[id_index_map[i]] = i
+		self._reorder(ordering)
+
+	def _reorder(self, ordering):
+		"""Renumbers the users of the converted link matrix and map in the order
+		given by node_order
+		"""
+		self._ordering = ordering
+		if ordering is None:
+			return
+		order = node_order(self._link_matrix, ordering)
+		rank = np.empty(len(order), dtype=np.int64)
+		rank[order] = np.arange(len(order))
+		link_matrix = self._link_matrix.tocoo()
+		self._link_matrix = edges_to_csr(rank[link_matrix.row], rank[link_matrix.col], len(order))
+		self._index_id_map = {i: self._index_id_map[index] for i, index in enumerate(order.tolist())}
+
+	def merge(self, map_path, link_matrix_path, user_store_path='', users=None):
+		"""Merges the adjacency list, journal or CrawlGraph of this converter (eg.
+		a new crawl) into a saved map and sparse link matrix, instead of
+		converting it on its own. Saved users keep their indices and new users
+		are appended in the order they are found, so scores saved by index stay
+		valid. Edges are only added, never removed. The merged link matrix and
+		map are stored by save as after convert
+
+		Args:
+			map_path: Path to the saved map from link matrix index to user id
+			link_matrix_path: Path to the saved sparse link matrix, either a
+			.npz file or a directory written by save_csr_mmap
+			user_store_path: Path to the saved UserStore of the same users, if
+			any. Its users, with the new ones, are then saved by
+			save(user_store_path=...)
+			users: Dictionary of the details of the new users, needed for the
+			UserStore if the crawl is an adjacency list (a journal or CrawlGraph
+			has its own)
+		"""
+		with open(map_path, 'rb') as f:
+			index_id_map = pickle.load(f)
+		if os.path.isdir(link_matrix_path):
+			link_matrix = load_csr_mmap(link_matrix_path)
+		else:
+			link_matrix = sparse.load_npz(link_matrix_path)
+		ordering = None
+		if os.path.exists(map_path + '.json'):
+			with open(map_path + '.json') as f:
+				ordering = json.load(f).get('ordering')
+
+		id_index_map = {index_id_map[i]: i for i in range(len(index_id_map))}
+
+		def index_of(user_id):
+			index = id_index_map.get(user_id)
+			if index is None:
+				index = len(id_index_map)
+				id_index_map[user_id] = index
+				index_id_map[index] = user_id
+			return index
 
-	def save(self, map_path, link_matrix_path, use_sparse=False):
+		if self._graph is not None:
+			indices = np.array([index_of(user_id) for user_id in self._graph.get_ids().tolist()],
+				dtype=np.int64)
+			rows, cols = self._graph.get_edges()
+			rows = indices[rows]
+			cols = indices[cols]
+		else:
+			rows = array.array('q')
+			cols = array.array('q')
+			for user_id in self._adj_list:
+				user_index = index_of(user_id)
+				for friend_id in self._adj_list[user_id]['friends']:
+					rows.append(user_index)
+					cols.append(index_of(friend_id))
+				for follower_id in self._adj_list[user_id]['followers']:
+					rows.append(index_of(follower_id))
+					cols.append(user_index)
+
+		self._link_matrix = merge_edges(link_matrix, rows, cols, len(id_index_map))
+		self._index_id_map = index_id_map
+
+		# Details of all users: the new ones over those of the saved store. The
+		# store is read into memory, as save may write it to the same files
+		layers = [users or {}]
+		if self._graph is not None:
+			layers.append(self._graph)
+		if user_store_path != '':
+			layers.append(UserStore(user_store_path, use_mmap=False).as_users())
+		self._users = collections.ChainMap(*layers)
+		# The saved users keep their ordering, with the new users after them
+		self._ordering = ordering
+
+	def get_metadata(self):
+		"""Returns the description of the converted link matrix that save
+		stores with it: the ordering of the users and the numbers of users and
+		of edges
+		"""
+		return {
+			'ordering': self._ordering,
+			'users': int(self._link_matrix.shape[0]),
+			'edges': int(self._link_matrix.nnz)
+		}
+
+	def save(
+		self, map_path, link_matrix_path, use_sparse=False, use_mmap=False,
+		user_store_path='', users=None, dtype=np.float64):
 		"""Saves the map and link matrix created using the convert function
 
 		Args:
 			map_path: Path to the file where the map from link matrix index to
-			user id is to be stored
+			user id is to be stored. The metadata of get_metadata is stored in
+			map_path + '.json', and in the header of a memory-mappable link matrix
 			link_matrix_path: Path to the file where the link matrix is to be stored
 			use_sparse: True if the link matrix is to be stored as a sparse matrix
+			use_mmap: True if a sparse link matrix is to be stored in the
+			memory-mappable format of save_csr_mmap (link_matrix_path is then a
+			directory). Dense link matrices can always be memory-mapped
+			user_store_path: Path to the directory where users info is to be
+			stored as a UserStore, in link matrix order
+			users: Dictionary of the details of all users, needed for the
+			UserStore unless a journal or CrawlGraph was converted
+			dtype: Type of the entries of the saved link matrix. This should be
+			the dtype (or matrix_dtype) of the HITS it is loaded into, which then
+			uses the (memory-mapped) entries without converting them
 		"""
+		if user_store_path != '':
+			if users is None:
+				users = self._users
+			if users is None:
+				raise ValueError('The details of the users are needed for a UserStore')
+			ids = [self._index_id_map[i] for i in range(len(self._index_id_map))]
+			missing = [user_id for user_id in ids if user_id not in users]
+			if missing:
+				raise ValueError('%d users (eg. %d) have no details for the UserStore. '
+					'Pass users, or the saved UserStore to merge' % (len(missing), missing[0]))
+			UserStore.save(user_store_path, ids, users)
+
 		if map_path != '':
 			with open(map_path, 'wb') as f:
 				try:
 					pickle.dump(self._index_id_map, f)
 				except Exception as e:
 					self._logger.log('Exception:', repr(e))
+			with open(map_path + '.json', 'w') as f:
+				json.dump(self.get_metadata(), f)
+
+		link_matrix = self._link_matrix
+		if link_matrix_path != '' and link_matrix.dtype != dtype:
+			link_matrix = sparse.csr_matrix((link_matrix.data.astype(dtype),
+				link_matrix.indices, link_matrix.indptr), shape=link_matrix.shape, copy=False)
 
-		if link_matrix_path != '':
+		if link_matrix_path != '' and use_sparse and use_mmap:
+			try:
+				save_csr_mmap(link_matrix_path, link_matrix, self.get_metadata())
+			except Exception as e:
+				self._logger.log('Exception:', repr(e))
+		elif link_matrix_path != '':
 			with open(link_matrix_path, mode='wb') as f:
 				if use_sparse:
 					try:
-						sparse.save_npz(f, sparse.csr_matrix(self._link_matrix))
+						sparse.save_npz(f, link_matrix)
 					except Exception as e:
 						self._logger.log('Exception:', repr(e))
 				else:
 					try:
-						np.save(f, self._link_matrix)
+						np.save(f, link_matrix.toarray())
 					except Exception as e:
 						self._logger.log('Exception:', repr(e))
 
@@ -379,11 +2090,13 @@ def main():
 	users_path = '../data/users'
 	adj_list_path = '../data/adj_list'
 	map_path = '../data/map'
+	user_store_path = '../data/user_store'
 	dense_link_matrix_path = '../data/dense_link_matrix'
 	sparse_link_matrix_path = '../data/sparse_link_matrix'
 
-	users_temp_path = '../data/temp/users_'
-	adj_list_temp_path = '../data/temp/adj_list_'
+	journal_path = '../data/temp/journal'
+	checkpoint_path = '../data/temp/checkpoint'
+	cache_path = '../data/temp/cache.sqlite'
 
 	friends_limit = 200
 	followers_limit = 200
@@ -392,24 +2105,21 @@ def main():
 	logger = Logger(log_path)
 
 	# Fetch the dataset, store info of all users and store the adjacency list
-	app = DatasetFetcher(key, secret, logger)
+	app = DatasetFetcher(key, secret, logger, ResponseCache(cache_path))
 	logger.log('Obtaining dataset..')
 	app.get_dataset(
-		seed_user, friends_limit, followers_limit, limit, True, users_temp_path,
-		adj_list_temp_path)
+		seed_user, friends_limit, followers_limit, limit, True, journal_path,
+		checkpoint_path, resume=os.path.exists(checkpoint_path))
 	logger.log('Dataset obtained')
-	app.save_dataset(users_path, adj_list_path)
+	app.save_dataset(users_path, adj_list_path, user_store_path)
 
-	# Create the link matrix and map using the adjacency list created
-	# previously and save them
-	c = ListToMatrixConverter(adj_list_path)
+	# Create the link matrix and map from the graph of the crawl and save them
+	c = ListToMatrixConverter(graph=app.get_graph())
 	c.convert()
 	c.save(map_path, dense_link_matrix_path, use_sparse=False)
-
-	c = ListToMatrixConverter(adj_list_path)
-	c.convert()
 	c.save(map_path, sparse_link_matrix_path, use_sparse=True)
 	logger.log('Dataset Saved')
+	logger.close()
 
 if __name__ == '__main__':
 	main()
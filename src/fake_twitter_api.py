@@ -0,0 +1,225 @@
+import pickle
+import threading
+import time
+import numpy as np
+import tweepy
+from dataset_fetcher import EdgeJournal, edges_to_csr
+
+class FakeTwitterGraph():
+	"""An instance of FakeTwitterGraph is the graph served by FakeTwitterAPI:
+	the users, and the friends and followers of each user, held as CSR arrays
+
+	An edge is taken from both sides of a recorded adjacency list (B is a
+	friend of A, or A is a follower of B), so every user has complete lists of
+	friends and followers
+	"""
+
+	def __init__(self, users, adj_list):
+		"""Initializes an instance of FakeTwitterGraph
+
+		Args:
+			users: Dictionary from user id to {'name': '', 'screen_name': ''}
+			adj_list: Adjacency list of the form saved by
+			DatasetFetcher.save_dataset (eg. from benchmark.generate_graph)
+		"""
+		self.ids = np.array(list(users), dtype=np.int64)
+		self.users = users
+		self._id_index_map = {user_id: index for index, user_id in enumerate(self.ids.tolist())}
+		self._screen_name_index_map = {
+			users[user_id]['screen_name']: index for user_id, index in self._id_index_map.items()}
+
+		rows = []
+		cols = []
+		for user_id in adj_list:
+			index = self._id_index_map[user_id]
+			for friend_id in adj_list[user_id]['friends']:
+				rows.append(index)
+				cols.append(self._id_index_map[friend_id])
+			for follower_id in adj_list[user_id]['followers']:
+				rows.append(self._id_index_map[follower_id])
+				cols.append(index)
+		friends = edges_to_csr(rows, cols, len(self.ids))
+		followers = friends.T.tocsr()
+		self._friends = (friends.indptr, friends.indices)
+		self._followers = (followers.indptr, followers.indices)
+
+	@staticmethod
+	def load(users_path, adj_list_path, is_journal=False):
+		"""Returns the FakeTwitterGraph of a saved dataset
+
+		Args:
+			users_path: Path to the pickled users dictionary
+			adj_list_path: Path to the pickled adjacency list, or to a journal
+			is_journal: True if adj_list_path is a journal written by EdgeJournal,
+			which also holds the users (users_path is then not used)
+		"""
+		if is_journal:
+			users, adj_list = EdgeJournal.read(adj_list_path)
+		else:
+			with open(users_path, 'rb') as f:
+				users = pickle.load(f)
+			with open(adj_list_path, 'rb') as f:
+				adj_list = pickle.load(f)
+		return FakeTwitterGraph(users, adj_list)
+
+	def index_of(self, user):
+		"""Returns the index of a user given by id, screen name or name, or None
+		if there is no such user
+		"""
+		if user in self._id_index_map:
+			return self._id_index_map[user]
+		if user in self._screen_name_index_map:
+			return self._screen_name_index_map[user]
+		for user_id in self.users:
+			if self.users[user_id]['name'] == user:
+				return self._id_index_map[user_id]
+		return None
+
+	def neighbours(self, index, friends_or_followers, start, stop):
+		"""Returns (ids, total), the ids of the friends/followers start to stop
+		of a user and the number of friends/followers the user has
+
+		Args:
+			index: Index of the user
+			friends_or_followers: 'friends' or 'followers'
+			start: Position of the first friend/follower
+			stop: Position after the last friend/follower
+		"""
+		indptr, indices = self._friends if friends_or_followers == 'friends' else self._followers
+		begin = indptr[index]
+		end = indptr[index + 1]
+		return self.ids[indices[min(begin + start, end):min(begin + stop, end)]].tolist(), end - begin
+
+class FakeUser():
+	"""A user, with the attributes of a tweepy User that the crawler uses
+	"""
+
+	def __init__(self, user_id, name, screen_name):
+		self.id = user_id
+		self.name = name
+		self.screen_name = screen_name
+
+class FakeResponse():
+	"""The HTTP response of a call, with the rate limit headers of the API
+	"""
+
+	def __init__(self, status_code, headers):
+		self.status_code = status_code
+		self.headers = headers
+
+class FakeTwitterAPI():
+	"""An instance of FakeTwitterAPI serves friends and followers pages from a
+	FakeTwitterGraph in place of tweepy.API, so that crawls can be run and
+	benchmarked without network access or credentials
+
+	Pages are cursored like the real API (-1 for the first page, 0 after the
+	last), every call waits for latency seconds, and each endpoint allows
+	limit calls per fixed window of window seconds, after which
+	tweepy.RateLimitError is raised until the window is reset. Responses carry
+	x-rate-limit headers, and api.last_response is set as tweepy does. One
+	instance stands for one credential
+	"""
+
+	def __init__(self, graph, latency=0.0, limits=None, window=15 * 60, max_count=200):
+		"""Initializes an instance of FakeTwitterAPI
+
+		Args:
+			graph: The FakeTwitterGraph to serve
+			latency: Seconds taken by each call
+			limits: Dictionary from endpoint ('friends'/'followers') to the
+			number of calls allowed per window
+			window: Length of the rate limit window in seconds
+			max_count: Largest page size
+		"""
+		if limits is None:
+			limits = {'friends': 15, 'followers': 15}
+		self._graph = graph
+		self._latency = latency
+		self._limits = limits
+		self._window = window
+		self._max_count = max_count
+		self._lock = threading.Lock()
+		self._reset = {endpoint: time.time() + window for endpoint in limits}
+		self._remaining = dict(limits)
+		self.calls = {endpoint: 0 for endpoint in limits}
+		self.rate_limited = {endpoint: 0 for endpoint in limits}
+		self.last_response = None
+
+	def _call(self, endpoint):
+		"""Waits for the latency of a call and counts it against the rate limit
+		of endpoint, returning its response
+
+		Raises:
+			tweepy.RateLimitError: The endpoint has no calls left in this window
+		"""
+		if self._latency > 0:
+			time.sleep(self._latency)
+		with self._lock:
+			now = time.time()
+			if now >= self._reset[endpoint]:
+				self._reset[endpoint] = now + self._window
+				self._remaining[endpoint] = self._limits[endpoint]
+			self.calls[endpoint] += 1
+			allowed = self._remaining[endpoint] > 0
+			if allowed:
+				self._remaining[endpoint] -= 1
+			else:
+				self.rate_limited[endpoint] += 1
+			response = FakeResponse(200 if allowed else 429, {
+				'x-rate-limit-limit': str(self._limits[endpoint]),
+				'x-rate-limit-remaining': str(self._remaining[endpoint]),
+				'x-rate-limit-reset': str(int(np.ceil(self._reset[endpoint])))
+			})
+		self.last_response = response
+		if not allowed:
+			raise tweepy.RateLimitError('Rate limit exceeded', response)
+		return response
+
+	def get_user(self, user):
+		"""Returns a user given by id, screen name or name
+		"""
+		index = self._graph.index_of(user)
+		if index is None:
+			raise tweepy.TweepError('User not found: ' + str(user))
+		user_id = int(self._graph.ids[index])
+		details = self._graph.users[user_id]
+		return FakeUser(user_id, details['name'], details['screen_name'])
+
+	def _page(self, endpoint, user_id, cursor, count):
+		"""Returns (users, (previous_cursor, next_cursor)) of a page of friends
+		or followers. Cursors are positions in the list of the user, plus one
+		"""
+		self._call(endpoint)
+		index = self._graph.index_of(user_id)
+		if index is None:
+			raise tweepy.TweepError('User not found: ' + str(user_id))
+		start = 0 if cursor == -1 else cursor - 1
+		stop = start + min(count, self._max_count)
+		ids, total = self._graph.neighbours(index, endpoint, start, stop)
+		users = [FakeUser(other_id, self._graph.users[other_id]['name'],
+			self._graph.users[other_id]['screen_name']) for other_id in ids]
+		return users, (0 if start == 0 else -(start + 1), stop + 1 if stop < total else 0)
+
+	def friends(self, user_id, cursor=-1, count=20):
+		"""Returns a page of the friends of a user, like tweepy.API.friends
+		"""
+		return self._page('friends', user_id, cursor, count)
+
+	def followers(self, user_id, cursor=-1, count=20):
+		"""Returns a page of the followers of a user, like tweepy.API.followers
+		"""
+		return self._page('followers', user_id, cursor, count)
+
+	def rate_limit_status(self):
+		"""Returns the remaining calls and reset times of the endpoints, in the
+		form of tweepy.API.rate_limit_status
+		"""
+		with self._lock:
+			resources = {}
+			for endpoint in self._limits:
+				resources[endpoint] = {'/' + endpoint + '/list': {
+					'limit': self._limits[endpoint],
+					'remaining': self._remaining[endpoint],
+					'reset': int(np.ceil(self._reset[endpoint]))
+				}}
+		return {'resources': resources}
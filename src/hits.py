@@ -1,21 +1,482 @@
 import numpy as np
 import scipy.sparse as sparse
+from scipy.sparse import _sparsetools
 import time
 import pickle
-from igraph import *
-from dataset_fetcher import ListToMatrixConverter
-import matplotlib.pyplot as plt
-import matplotlib.patches as mp
+import collections
+import json
+import os
+import concurrent.futures
+from dataset_fetcher import ListToMatrixConverter, UserStore, edges_to_csr, load_csr_mmap
+from score_store import top_k
 import time
 
 debug = False
 
+def _normalize(scores):
+	"""Divides scores by their maximum in place, unless the maximum is 0.
+	Returns the maximum
+	"""
+	max_score = scores.max()
+	if max_score != 0:
+		np.divide(scores, max_score, out=scores)
+	return max_score
+
+def _max_change(scores, scores_old):
+	"""Returns the largest absolute change from scores_old to scores,
+	overwriting scores_old with the absolute changes
+	"""
+	np.subtract(scores, scores_old, out=scores_old)
+	np.abs(scores_old, out=scores_old)
+	return scores_old.max()
+
+def _dropped_max(scores, kept):
+	"""Returns the largest absolute score outside of the indices kept, or 0
+	"""
+	dropped = np.ones(len(scores), dtype=bool)
+	dropped[kept] = False
+	return float(np.abs(scores[dropped]).max()) if dropped.any() else 0.0
+
+def _min_epsilon(dtype):
+	"""Returns the smallest tolerance that scores of type dtype can converge
+	to. Rounding makes scores near 1 oscillate by about one unit in the last
+	place, so smaller tolerances would never be met
+	"""
+	return 8 * float(np.finfo(dtype).eps)
+
+class _SolverStopped(Exception):
+	"""Raised inside a solver that is out of iterations or time, with the
+	reason as stop_reason of ConvergenceStats
+	"""
+
+	def __init__(self, reason):
+		super().__init__(reason)
+		self.reason = reason
+
+def _normalize_columns(scores):
+	"""Divides each column of scores by its maximum in place, leaving columns
+	whose maximum is 0 unchanged
+	"""
+	max_scores = scores.max(axis=0)
+	max_scores[max_scores == 0] = 1
+	scores /= max_scores
+
+def _fused_iteration(indptr, indices, data, hubs, auths, new_hubs, new_auths):
+	"""Runs one iteration of HITS on a CSR link matrix, writing the new scores
+	to new_hubs and new_auths. Returns the largest change in hubs and in auths
+
+	Written with plain loops so that it can be compiled by numba. The link
+	matrix may be rectangular, with a hub per row and an authority per column
+	"""
+	n = len(hubs)
+	m = len(auths)
+	for i in range(m):
+		new_auths[i] = 0.0
+	for i in range(n):
+		h = hubs[i]
+		for k in range(indptr[i], indptr[i + 1]):
+			new_auths[indices[k]] += data[k] * h
+	max_score = 0.0
+	for i in range(m):
+		if new_auths[i] > max_score:
+			max_score = new_auths[i]
+	auths_delta = 0.0
+	for i in range(m):
+		if max_score != 0:
+			new_auths[i] /= max_score
+		auths_delta = max(auths_delta, abs(new_auths[i] - auths[i]))
+
+	max_score = 0.0
+	for i in range(n):
+		total = 0.0
+		for k in range(indptr[i], indptr[i + 1]):
+			total += data[k] * new_auths[indices[k]]
+		new_hubs[i] = total
+		if total > max_score:
+			max_score = total
+	hubs_delta = 0.0
+	for i in range(n):
+		if max_score != 0:
+			new_hubs[i] /= max_score
+		hubs_delta = max(hubs_delta, abs(new_hubs[i] - hubs[i]))
+	return hubs_delta, auths_delta
+
+_fused_kernel = None
+
+def _get_fused_kernel():
+	"""Returns _fused_iteration compiled by numba, or None if numba is not
+	installed. numba is only imported when first needed, as importing it is slow
+	"""
+	global _fused_kernel
+	if _fused_kernel is None:
+		try:
+			import numba
+		except ImportError:
+			_fused_kernel = False
+		else:
+			_fused_kernel = numba.njit(cache=True)(_fused_iteration)
+	return _fused_kernel or None
+
+class ScoreHistory():
+	"""An instance of ScoreHistory records the score vector of each iteration of
+	HITS.calc_scores, keeping only what its policy asks for
+	"""
+
+	def __init__(self, enabled=True, keep_last=None, every=1, nodes=None, path=None):
+		"""Initializes an instance of ScoreHistory. By default every vector of
+		every iteration is kept in memory
+
+		Args:
+			enabled: False if no history is to be kept at all
+			keep_last: If given, only the vectors of the last keep_last recorded
+			iterations are kept
+			every: Only every every-th iteration is recorded
+			nodes: If given, only the scores of these node (link matrix) indices
+			are recorded
+			path: If given, vectors are streamed to this file, which is then read
+			back as a memory-mapped array, instead of being kept in memory
+		"""
+		if keep_last is not None and path is not None:
+			raise ValueError('keep_last can not be used with a memory-mapped history')
+		self._enabled = enabled
+		self._every = every
+		self._nodes = None if nodes is None else np.asarray(nodes)
+		self._path = path
+		self._count = 0
+		self._width = None
+		if path is not None:
+			open(path, 'wb').close()
+		self._vectors = collections.deque(maxlen=keep_last)
+		self._iterations = collections.deque(maxlen=keep_last)
+
+	def append(self, iteration, vector):
+		"""Records the vector of an iteration if the policy asks for it
+
+		Args:
+			iteration: Iteration number, starting at 1
+			vector: Score of each node after that iteration
+		"""
+		if not self.records(iteration):
+			return
+		if self._nodes is not None:
+			vector = vector[self._nodes]
+		vector = np.array(vector, dtype=np.float64)
+		self._width = len(vector)
+		if self._path is not None:
+			with open(self._path, 'ab') as f:
+				vector.tofile(f)
+			self._count += 1
+		else:
+			self._vectors.append(vector)
+		self._iterations.append(iteration)
+
+	def records(self, iteration):
+		"""Returns True if the policy records the vector of an iteration
+
+		Args:
+			iteration: Iteration number, starting at 1
+		"""
+		return self._enabled and iteration % self._every == 0
+
+	def get(self):
+		"""Returns the recorded vectors, oldest first. For a memory-mapped history
+		this is a read-only memory-mapped array with one row per vector
+		"""
+		if self._path is not None:
+			if self._count == 0:
+				return np.empty((0, 0))
+			return np.memmap(self._path, dtype=np.float64, mode='r',
+				shape=(self._count, self._width))
+		return list(self._vectors)
+
+	def get_iterations(self):
+		"""Returns the iteration number of each recorded vector
+		"""
+		return list(self._iterations)
+
+	def columns(self, indices):
+		"""Returns (iterations, scores) of some nodes over the recorded
+		iterations, where scores has a row per iteration and a column per node
+
+		Args:
+			indices: Link matrix indices of the nodes
+		"""
+		columns = np.asarray(indices, dtype=np.int64)
+		if self._nodes is not None:
+			order = np.argsort(self._nodes, kind='mergesort')
+			positions = np.searchsorted(self._nodes, columns, sorter=order)
+			positions = np.minimum(positions, len(order) - 1)
+			found = self._nodes[order[positions]] == columns
+			if not found.all():
+				raise KeyError('Node ' + str(columns[~found][0]) + ' is not recorded in the history')
+			columns = order[positions]
+		vectors = self.get()
+		if len(vectors) == 0:
+			return np.array([]), np.empty((0, len(columns)))
+		# Gathered vector by vector, as stacking the vectors first would copy the
+		# whole history
+		return np.array(self.get_iterations()), np.array([vector[columns] for vector in vectors])
+
+	def series(self, index):
+		"""Returns (iterations, scores) of one node over the recorded iterations
+
+		Args:
+			index: Link matrix index of the node
+		"""
+		iterations, scores = self.columns([index])
+		return iterations, scores[:, 0]
+
+def _print_iteration(info):
+	"""Prints the details of an iteration. Used as a hook when debug is True
+	"""
+	print(' '.join('%s=%s' % (key, info[key]) for key in sorted(info)))
+
+class ConvergenceStats():
+	"""An instance of ConvergenceStats describes a run of HITS.calc_scores,
+	and every iteration of it if hooks were added. Summary values can also be
+	read like a dictionary, eg. stats['iterations']
+	"""
+
+	_summary = ('engine', 'iterations', 'matvecs', 'time', 'stop_reason',
+		'hubs_linf', 'auths_linf', 'matvec_time')
+
+	def __init__(self, engine):
+		"""Initializes an instance of ConvergenceStats
+
+		Args:
+			engine: Name of the engine of the run
+		"""
+		self.engine = engine
+		self.iterations = 0
+		self.matvecs = 0
+		self.time = None
+		self.stop_reason = None
+		self.hubs_linf = None
+		self.auths_linf = None
+		self.matvec_time = None
+		self.iteration_details = []
+
+	def add_iteration(self, info):
+		"""Records the details of an iteration, as given to hooks
+		"""
+		self.iteration_details.append(info)
+
+	def finish(self, seconds):
+		"""Records the total time of the run
+
+		Args:
+			seconds: Time taken by the run
+		"""
+		self.time = seconds
+		if self.iteration_details:
+			self.matvec_time = sum(info.get('hubs_matvec_seconds', 0)
+				+ info.get('auths_matvec_seconds', 0) for info in self.iteration_details)
+
+	def __getitem__(self, key):
+		if key not in ConvergenceStats._summary:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def to_dict(self):
+		"""Returns the summary and the details of every recorded iteration
+		"""
+		summary = {}
+		for key in ConvergenceStats._summary:
+			value = getattr(self, key)
+			if isinstance(value, np.ndarray):
+				value = value.tolist()
+			elif isinstance(value, np.generic):
+				value = value.item()
+			summary[key] = value
+		summary['iteration_details'] = self.iteration_details
+		return summary
+
+	def to_json(self):
+		"""Returns the stats as a JSON string
+		"""
+		return json.dumps(self.to_dict())
+
+	def to_prometheus(self, prefix='hits_'):
+		"""Returns the summary in the Prometheus text exposition format
+
+		Args:
+			prefix: Prefix of the metric names
+		"""
+		lines = []
+		label = '{engine="%s"}' % self.engine
+		for key in ('iterations', 'matvecs', 'time', 'hubs_linf', 'auths_linf', 'matvec_time'):
+			value = getattr(self, key)
+			if value is None or isinstance(value, np.ndarray):
+				continue
+			name = prefix + key + ('_seconds' if key.endswith('time') else '')
+			lines.append('# TYPE %s gauge' % name)
+			lines.append('%s%s %s' % (name, label, repr(float(value))))
+		lines.append('# TYPE %sconverged gauge' % prefix)
+		lines.append('%sconverged%s %d' % (prefix, label, self.stop_reason == 'converged'))
+		return '\n'.join(lines) + '\n'
+
+class GraphPlotter():
+	"""An instance of GraphPlotter draws a subgraph of chosen users, with the
+	size of each user given by its score
+
+	The subgraph is taken straight from the (sparse or dense) link matrix and
+	its layout is computed only once, so that every frame of an animation
+	over the iterations, as well as the hubbiness and the authority plots,
+	reuse it. Frames written to files are rendered by a background thread
+	"""
+
+	colors = ('red', 'yellow')
+
+	def __init__(self, link_matrix, nodes, names, layout='kk', workers=1):
+		"""Initializes an instance of GraphPlotter
+
+		Args:
+			link_matrix: The link matrix
+			nodes: Link matrix indices of the users to draw
+			names: Screen name of each of these users
+			layout: Name of the igraph layout algorithm
+			workers: Number of threads rendering frames to files
+		"""
+		self._nodes = np.asarray(nodes)
+		self._names = list(names)
+		if sparse.issparse(link_matrix):
+			subgraph = sparse.coo_matrix(link_matrix[self._nodes][:, self._nodes])
+			rows, cols = subgraph.row, subgraph.col
+		else:
+			rows, cols = np.nonzero(np.asarray(link_matrix)[np.ix_(self._nodes, self._nodes)])
+		self._edges = list(zip(rows.tolist(), cols.tolist()))
+		self._layout_name = layout
+		self._layout = None
+		self._workers = workers
+		self._executor = None
+		self._frames = []
+
+	def get_nodes(self):
+		"""Returns the link matrix indices of the users drawn
+		"""
+		return self._nodes
+
+	def _graph(self):
+		"""Returns a new igraph Graph of the subgraph
+		"""
+		# Imported here so that scoring does not need (or pay for) igraph
+		from igraph import Graph
+
+		g = Graph(n=len(self._nodes), edges=self._edges, directed=True)
+		g.vs["name"] = self._names
+		return g
+
+	def get_layout(self):
+		"""Returns the layout of the subgraph, computing it on first use
+		"""
+		if self._layout is None:
+			self._layout = self._graph().layout(self._layout_name)
+		return self._layout
+
+	def _render(self, x, c, path, names=None):
+		"""Draws the subgraph with scores x of its users, to path if given or
+		else on screen. The users are labelled with names if given, and with
+		their screen names otherwise
+		"""
+		from igraph import plot
+
+		g = self._graph()
+		array_min = max(x.min(), 0.001)
+		visual_style = {}
+		visual_style["vertex_size"] = [(k / array_min) * 0.3 if k >= 0.001 else 10 for k in x]
+		labels = self._names if names is None else names
+		visual_style["vertex_label"] = [(name, float("%.3f" % k)) for name, k in zip(labels, x)]
+		visual_style["vertex_color"] = GraphPlotter.colors[c]
+		visual_style["edge_arrow_size"] = 2
+		visual_style["vertex_label_size"] = 35
+		visual_style["layout"] = self.get_layout()
+		visual_style["bbox"] = (3200, 2200)
+		visual_style["margin"] = 250
+		visual_style["edge_width"] = 4
+		if path is None:
+			plot(g, **visual_style)
+		else:
+			plot(g, path, **visual_style)
+
+	def _submit(self, x, c, path, names=None):
+		"""Draws scores of the users drawn, blocking only when shown on screen
+		"""
+		# The layout is computed here, so that frames never compute it twice
+		self.get_layout()
+		if path is None:
+			self._render(x, c, None, names)
+			return None
+		if self._executor is None:
+			self._executor = concurrent.futures.ThreadPoolExecutor(self._workers)
+		future = self._executor.submit(self._render, x, c, path, names)
+		self._frames.append(future)
+		return future
+
+	def plot(self, x, c, path=None, names=None):
+		"""Draws the subgraph. Shows it and blocks if no path is given, and
+		otherwise returns a Future of the rendering of the image file
+
+		Args:
+			x: Score of each user, in link matrix index order
+			c: 0 to color users as hubs, 1 to color them as authorities
+			path: Path to the image file to render to (eg. a .png)
+			names: Label of each user, indexed by link matrix index (a sequence
+			or a dictionary). Defaults to the screen names
+		"""
+		if names is not None:
+			names = [names[i] for i in self._nodes.tolist()]
+		return self._submit(np.array(x)[self._nodes], c, path, names)
+
+	def plot_history(self, history, c, directory, prefix):
+		"""Renders a frame for each iteration recorded in a ScoreHistory to
+		directory/prefix_<iteration>.png in the background, and returns the
+		paths of the frames
+
+		Args:
+			history: The ScoreHistory, eg. HITS.get_hubs_history()
+			c: 0 to color users as hubs, 1 to color them as authorities
+			directory: Directory to render the frames to
+			prefix: Prefix of the names of the frames
+		"""
+		os.makedirs(directory, exist_ok=True)
+		iterations, scores = history.columns(self._nodes)
+		paths = []
+		for iteration, x in zip(iterations, scores):
+			path = os.path.join(directory, '%s_%04d.png' % (prefix, iteration))
+			self._submit(x, c, path)
+			paths.append(path)
+		return paths
+
+	def wait(self):
+		"""Waits until every frame has been rendered, raising the first error of
+		a frame if any
+		"""
+		frames = self._frames
+		self._frames = []
+		for future in frames:
+			future.result()
+
+	def close(self):
+		"""Waits for all frames and stops the background threads
+		"""
+		self.wait()
+		if self._executor is not None:
+			self._executor.shutdown()
+			self._executor = None
+
 class HITS():
 	"""An instance of HITS is used to model the idea of hubs and authorities
 	and execute the corresponding algorithm
 	"""
 
-	def __init__(self, link_matrix, users, index_id_map, is_sparse=False):
+	# Used by is_sparse='auto': a link matrix is used densely only if it has at
+	# least this density and its dense form fits in this many bytes
+	AUTO_DENSITY = 0.05
+	AUTO_DENSE_BYTES = 2 ** 28
+
+	def __init__(
+		self, link_matrix, users, index_id_map, is_sparse=False, history=None,
+		dtype=np.float64, matrix_dtype=None):
 		"""
 		Initializes an instance of HITS
 
@@ -24,83 +485,934 @@ class HITS():
 			users: Details of all users
 			index_id_map: Dictionary representing a map from link matrix index
 			to user id
-			is_sparse: True if the links matrix is a sparse matrix
+			is_sparse: True if the links matrix is to be used as a sparse matrix,
+			False if it is to be used as a dense matrix, or 'auto' to choose from
+			its size and density. The link matrix is converted if needed
+			history: Dictionary of keyword arguments of ScoreHistory, giving the
+			policy for keeping the scores of each iteration. If it has a path,
+			hubs and auths are streamed to path + '_hubs' and path + '_auths'.
+			By default every iteration is kept in memory
+			dtype: Type of the scores, np.float64 or np.float32. float32 halves
+			the memory moved by each iteration
+			matrix_dtype: Type of the entries of a sparse link matrix. Defaults to
+			dtype, so that products need no conversion. 'pattern' stores the
+			entries as 1 byte each, which the JIT compiled fused engine reads
+			directly. It needs numba and can only be used with the fused engine,
+			as every other product would convert the entries to dtype each time.
+			Dense link matrices always use dtype
 		"""
+		if is_sparse == 'auto':
+			is_sparse = self.__choose_sparse(link_matrix, np.dtype(dtype))
 		self.__is_sparse = is_sparse
-		self.__link_matrix = link_matrix
-		self.__link_matrix_tr = link_matrix.transpose()	
+		self.__dtype = np.dtype(dtype)
+		self.__pattern = matrix_dtype == 'pattern' and bool(is_sparse)
+		if self.__pattern and _get_fused_kernel() is None:
+			raise ValueError("matrix_dtype='pattern' needs numba")
+		self.__matrix_dtype = np.int8 if matrix_dtype == 'pattern' else matrix_dtype
+		self.__link_matrix = None
+		self.__set_link_matrix(link_matrix)
 		self.__n = self.__link_matrix.shape[0]
-		self.__hubs = np.ones(self.__n)
-		self.__auths = np.ones(self.__n)
+		self.__pruned = None
+		self.__batch_hubs = None
+		self.__batch_auths = None
+		self.__hubs = np.ones(self.__n, dtype=self.__dtype)
+		self.__auths = np.ones(self.__n_auths, dtype=self.__dtype)
 		self.__size = 30
-		self.__names = [users[index_id_map[i]]['screen_name'] for i in range(0,self.__size)]
+		self.__names = [users[index_id_map[i]]['screen_name'] for i in range(0,min(self.__size, self.__n))]
 		self.__index_id_map = index_id_map
+		self.__given_index_id_map = index_id_map
+		self.__id_index_map = None
 		self.__users = users
-		self.all_hubs = []
-		self.all_auths = []
+		self.__stats = None
+		self.__hooks = []
+		self.__plotters = {}
+		self.__details = None
+		if history is None:
+			history = {}
+		hubs_history = dict(history)
+		auths_history = dict(history)
+		if history.get('path') is not None:
+			hubs_history['path'] = history['path'] + '_hubs'
+			auths_history['path'] = history['path'] + '_auths'
+		self.__hubs_history = ScoreHistory(**hubs_history)
+		self.__auths_history = ScoreHistory(**auths_history)
+
+	@property
+	def all_hubs(self):
+		"""Hubbiness scores of the iterations recorded by the history policy
+		"""
+		return self.__hubs_history.get()
+
+	@property
+	def all_auths(self):
+		"""Authority scores of the iterations recorded by the history policy
+		"""
+		return self.__auths_history.get()
 
-	def calc_scores(self, epsilon=1e-4):
+	def calc_scores(
+		self, epsilon=1e-4, engine='power', workers=None, max_iter=None,
+		time_budget=None, prune=False, components=False):
 		"""Calculates hubbiness and authority
+
+		Scores are updated until no score changes by epsilon or more in an
+		iteration. Iterations continue from the current scores
+
+		Args:
+			epsilon: Tolerance for convergence. Raised to 8 times the machine
+			epsilon of the type of the scores (about 1e-6 for float32) if smaller
+			engine: 'power' for plain power iteration, 'fused' for power
+			iteration that reuses preallocated buffers (and is JIT compiled if
+			numba is installed), 'parallel' for power iteration with the products
+			split over row blocks of a sparse link matrix run by a thread pool,
+			or 'svd' for a sparse (ARPACK) truncated SVD of the link matrix,
+			which leaves the scores unchanged if it stops before converging
+			workers: Number of threads used by the 'parallel' engine, or by
+			components. Defaults to the number of CPUs
+			max_iter: If given, stop after this many iterations even if the
+			scores have not converged
+			time_budget: If given, stop after the iteration during which this many
+			seconds have passed, even if the scores have not converged
+			prune: True if users without friends (whose hubbiness is 0) and
+			without followers (whose authority is 0) are left out of the
+			products. The scores are the same as without pruning
+			components: True if each weakly connected component is solved on its
+			own, in parallel, after pruning. See __component_scores for how the
+			scores of the components are combined
 		"""
-		epsilon_matrix = epsilon * np.ones(self.__n)
-		if self.__is_sparse:			
-			while True:
-				hubs_old = self.__hubs
-				auths_old = self.__auths
+		start = time.time()
+		self.__plotters = {}
+		if engine not in ('power', 'fused', 'parallel', 'svd'):
+			raise ValueError('Unknown engine: ' + str(engine))
+		if self.__pattern and engine != 'fused':
+			raise ValueError("matrix_dtype='pattern' can only be used with the fused engine")
+		epsilon = max(epsilon, _min_epsilon(self.__dtype))
+		if components:
+			self.__component_scores(epsilon, engine, workers, max_iter, time_budget)
+		elif prune:
+			self.__pruned_scores(epsilon, engine, workers, max_iter, time_budget, start)
+		else:
+			self.__solve(epsilon, engine, workers, max_iter, time_budget, start)
+		self.__stats.finish(time.time() - start)
+
+	def __solve(self, epsilon, engine, workers, max_iter, time_budget, start, dropped=None):
+		"""Runs an engine on the current link matrix and scores, recording the
+		history and calling the hooks
+
+		Args:
+			dropped: Largest changes (hubs, auths) of scores left out of the
+			link matrix by pruning, which all become 0 in the first iteration
+		"""
+		if engine == 'svd':
+			self.__svd_scores(epsilon, max_iter, time_budget, start)
+			self.__record(1)
+			return
+
+		engines = {
+			'power': self.__power_steps,
+			'fused': self.__fused_steps,
+			'parallel': lambda: self.__parallel_steps(workers)
+		}
+		hooks = list(self.__hooks)
+		if debug:
+			hooks.append(_print_iteration)
+		# Engines only fill in details (which cost extra time) if a hook wants them
+		self.__details = {} if hooks else None
+		stats = ConvergenceStats(engine)
+		iteration = 0
+		hubs_delta = auths_delta = None
+		last = time.time()
+		for hubs_delta, auths_delta in engines[engine]():
+			iteration += 1
+			if iteration == 1 and dropped is not None:
+				hubs_delta = max(hubs_delta, dropped[0])
+				auths_delta = max(auths_delta, dropped[1])
+			self.__record(iteration)
+			if hooks:
+				now = time.time()
+				info = dict(self.__details)
+				info.update(iteration=iteration, hubs_linf=float(hubs_delta),
+					auths_linf=float(auths_delta), seconds=now - last)
+				last = now
+				stats.add_iteration(info)
+				for hook in hooks:
+					hook(info)
+			if hubs_delta < epsilon and auths_delta < epsilon:
+				stats.stop_reason = 'converged'
+				break
+			if max_iter is not None and iteration >= max_iter:
+				stats.stop_reason = 'max_iter'
+				break
+			if time_budget is not None and time.time() - start >= time_budget:
+				stats.stop_reason = 'time_budget'
+				break
+
+		self.__details = None
+		stats.iterations = iteration
+		stats.matvecs = 2 * iteration
+		stats.hubs_linf = hubs_delta
+		stats.auths_linf = auths_delta
+		self.__stats = stats
+
+	def __record(self, iteration):
+		"""Appends the scores of an iteration to the histories, scattered back to
+		all users if the link matrix is pruned
+		"""
+		for history, scores, kept, n in (
+			(self.__auths_history, self.__auths, self.__pruned and self.__pruned[1], self.__n_auths),
+			(self.__hubs_history, self.__hubs, self.__pruned and self.__pruned[0], self.__n)):
+			if not history.records(iteration):
+				continue
+			if self.__pruned:
+				full = np.zeros(n, dtype=scores.dtype)
+				full[kept] = scores
+				scores = full
+			history.append(iteration, scores)
 
-				self.__auths = self.__link_matrix_tr * hubs_old
-				max_score = self.__auths.max(axis=0)
-				if max_score != 0:
-					self.__auths = self.__auths / max_score
-				self.all_auths.append(self.__auths)
+	@staticmethod
+	def __degrees(link_matrix):
+		"""Returns the number of friends and of followers of each user
+		"""
+		if sparse.issparse(link_matrix):
+			link_matrix = link_matrix.tocsr()
+			out_degree = np.diff(link_matrix.indptr)
+			in_degree = np.bincount(link_matrix.indices[:link_matrix.nnz],
+				minlength=link_matrix.shape[1])
+		else:
+			nonzero = np.asarray(link_matrix) != 0
+			out_degree = nonzero.sum(axis=1)
+			in_degree = nonzero.sum(axis=0)
+		return out_degree, in_degree
 
-				self.__hubs = self.__link_matrix * self.__auths
-				max_score = self.__hubs.max(axis=0)
-				if max_score != 0:
-					self.__hubs = self.__hubs / max_score
-				self.all_hubs.append(self.__hubs)
+	def __pruned_scores(self, epsilon, engine, workers, max_iter, time_budget, start):
+		"""Runs an engine on the link matrix without the rows of users without
+		friends and the columns of users without followers
 
-				if (((abs(self.__hubs - hubs_old)) < epsilon_matrix).all()) and (((abs(self.__auths - auths_old)) < epsilon_matrix).all()):
-					break
+		Those scores are 0 after the first iteration and do not affect the
+		others, so the iterations are the same as on the whole link matrix
+		"""
+		out_degree, in_degree = self.__degrees(self.__link_matrix)
+		rows = np.flatnonzero(out_degree)
+		cols = np.flatnonzero(in_degree)
+		if len(rows) == 0 or len(rows) == self.__n and len(cols) == self.__n_auths:
+			self.__solve(epsilon, engine, workers, max_iter, time_budget, start)
+			return
 
+		link_matrix = self.__link_matrix
+		hubs = np.array(self.__hubs, dtype=self.__dtype)
+		auths = np.array(self.__auths, dtype=self.__dtype)
+		dropped = (_dropped_max(hubs, rows), _dropped_max(auths, cols))
+		if self.__is_sparse:
+			self.__link_matrix = link_matrix.tocsr()[rows][:, cols]
 		else:
+			self.__link_matrix = link_matrix[np.ix_(rows, cols)]
+		self.__hubs = hubs[rows]
+		self.__auths = auths[cols]
+		self.__pruned = (rows, cols)
+		try:
+			self.__solve(epsilon, engine, workers, max_iter, time_budget, start, dropped)
+		finally:
+			full_hubs = np.zeros(self.__n, dtype=self.__dtype)
+			full_auths = np.zeros(self.__n_auths, dtype=self.__dtype)
+			full_hubs[rows] = self.__hubs
+			full_auths[cols] = self.__auths
+			self.__hubs = full_hubs
+			self.__auths = full_auths
+			self.__link_matrix = link_matrix
+			self.__pruned = None
+
+	def __component_scores(self, epsilon, engine, workers, max_iter, time_budget):
+		"""Calculates the scores of each weakly connected component of the
+		pruned link matrix on its own, in parallel, and combines them
+
+		Power iteration on the whole link matrix tends to the leading singular
+		vectors of the components with the largest top singular value, weighted
+		by how much of the starting hubbiness lies along them; the scores of the
+		other components tend to 0. The combined scores are that limit, so they
+		can differ from the scores of a run on the whole link matrix in the
+		components with a smaller (but close) singular value, which a finite
+		number of iterations has not yet driven to 0. History only records the
+		combined scores, and hooks are not called
+		"""
+		from scipy.sparse.csgraph import connected_components
+
+		link_matrix = self.__link_matrix
+		if self.__is_sparse:
+			link_matrix = link_matrix.tocsr()
+		out_degree, in_degree = self.__degrees(link_matrix)
+		count, labels = connected_components(sparse.csr_matrix(link_matrix),
+			directed=True, connection='weak')
+		rows = np.flatnonzero(out_degree)
+		cols = np.flatnonzero(in_degree)
+		# Users of each component with friends and with followers, in index order
+		row_groups = np.split(rows[np.argsort(labels[rows], kind='mergesort')],
+			np.cumsum(np.bincount(labels[rows], minlength=count))[:-1])
+		col_groups = np.split(cols[np.argsort(labels[cols], kind='mergesort')],
+			np.cumsum(np.bincount(labels[cols], minlength=count))[:-1])
+		groups = [(r, c) for r, c in zip(row_groups, col_groups) if len(r) > 0]
+
+		hubs = np.array(self.__hubs, dtype=self.__dtype)
+		auths = np.array(self.__auths, dtype=self.__dtype)
+
+		def solve(group):
+			component_rows, component_cols = group
+			if self.__is_sparse:
+				matrix = link_matrix[component_rows][:, component_cols]
+			else:
+				matrix = link_matrix[np.ix_(component_rows, component_cols)]
+			index_id_map = {i: self.__index_id_map[int(index)] for i, index in enumerate(component_rows)}
+			h = HITS(matrix, self.__users, index_id_map, is_sparse=self.__is_sparse,
+				history={'enabled': False}, dtype=self.__dtype,
+				matrix_dtype='pattern' if self.__pattern else self.__matrix_dtype)
+			h.set_scores(hubs[component_rows], auths[component_cols])
+			h.calc_scores(epsilon=epsilon, engine=engine, workers=1, max_iter=max_iter,
+				time_budget=time_budget)
+			component_hubs = h.get_hubs().astype(np.float64)
+			component_auths = h.get_auths().astype(np.float64)
+			# Top singular value, from A a = sigma h
+			auths_norm = np.linalg.norm(component_auths)
+			sigma = np.linalg.norm(matrix.dot(component_auths)) / auths_norm if auths_norm else 0.0
+			return component_hubs, component_auths, sigma, h.get_stats()
+
+		with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+			results = list(executor.map(solve, groups))
+
+		new_hubs = np.zeros(self.__n, dtype=np.float64)
+		new_auths = np.zeros(self.__n_auths, dtype=np.float64)
+		sigma_max = max([result[2] for result in results], default=0.0)
+		for (component_rows, component_cols), (component_hubs, component_auths, sigma, _) in zip(groups, results):
+			hubs_norm = np.linalg.norm(component_hubs)
+			auths_norm = np.linalg.norm(component_auths)
+			if sigma == 0 or sigma < sigma_max * (1 - epsilon) or hubs_norm == 0 or auths_norm == 0:
+				continue
+			weight = np.dot(component_hubs, hubs[component_rows]) / hubs_norm
+			new_hubs[component_rows] = weight * component_hubs / hubs_norm
+			new_auths[component_cols] = weight * component_auths / auths_norm
+		_normalize(new_hubs)
+		_normalize(new_auths)
+		self.__hubs = new_hubs.astype(self.__dtype)
+		self.__auths = new_auths.astype(self.__dtype)
+		self.__record(1)
+
+		stats = ConvergenceStats(engine)
+		stats.iterations = max([result[3]['iterations'] for result in results], default=0)
+		stats.matvecs = sum(result[3]['matvecs'] for result in results)
+		reasons = [result[3]['stop_reason'] for result in results if result[3]['stop_reason'] != 'converged']
+		stats.stop_reason = reasons[0] if reasons else 'converged'
+		linf = [result[3] for result in results if result[3]['hubs_linf'] is not None]
+		if linf:
+			stats.hubs_linf = max(result['hubs_linf'] for result in linf)
+			stats.auths_linf = max(result['auths_linf'] for result in linf)
+		self.__stats = stats
+
+	def __parallel_steps(self, workers):
+		"""Runs power iteration with the work of each iteration split over
+		workers threads, yielding the largest change in hubs and in auths after
+		each iteration
+
+		A^T is built once in CSR form, so that both products gather over rows:
+		A a into slices of the hubs and A^T h into slices of the auths. Each
+		matrix is split into row blocks holding about the same number of edges,
+		which share the arrays of the matrix. The sparse products release the
+		GIL, so the blocks run in parallel on the shared score arrays, and
+		memory stays O(n + edges) whatever the number of workers
+		"""
+		if not self.__is_sparse:
+			raise ValueError("The 'parallel' engine needs a sparse link matrix")
+		if workers is None:
+			workers = os.cpu_count() or 1
+		rows, cols = self.__link_matrix.shape
+		dtype = self.__dtype
+		link_matrix = self.__link_matrix.tocsr()
+		if link_matrix.dtype != dtype:
+			link_matrix = sparse.csr_matrix((link_matrix.data.astype(dtype),
+				link_matrix.indices, link_matrix.indptr), shape=link_matrix.shape, copy=False)
+		link_matrix_tr = link_matrix.transpose().tocsr()
+
+		def row_blocks(matrix):
+			"""Returns (start, end, block) for row blocks of matrix with about the
+			same number of edges, each block a view of the arrays of matrix
+			"""
+			bounds = np.searchsorted(matrix.indptr,
+				np.linspace(0, matrix.nnz, workers + 1), side='left')
+			bounds[0] = 0
+			bounds[-1] = matrix.shape[0]
+			blocks = []
+			for start, end in zip(bounds[:-1], bounds[1:]):
+				first = matrix.indptr[start]
+				last = matrix.indptr[end]
+				# The constructor would copy slices that are small parts of their
+				# arrays, so the arrays are set afterwards
+				block = sparse.csr_matrix((end - start, matrix.shape[1]), dtype=dtype)
+				block.data = matrix.data[first:last]
+				block.indices = matrix.indices[first:last]
+				block.indptr = matrix.indptr[start:end + 1] - first
+				blocks.append((start, end, block))
+			return blocks
+
+		hub_blocks = row_blocks(link_matrix)
+		auth_blocks = row_blocks(link_matrix_tr)
+		# Slices of equal size for the elementwise work
+		hub_bounds = np.linspace(0, rows, workers + 1).astype(np.int64)
+		col_bounds = np.linspace(0, cols, workers + 1).astype(np.int64)
+
+		hubs = np.array(self.__hubs, dtype=dtype)
+		auths = np.array(self.__auths, dtype=dtype)
+		new_hubs = np.empty(rows, dtype=dtype)
+		new_auths = np.empty(cols, dtype=dtype)
+
+		def product(blocks, vector, out, w):
+			start, end, block = blocks[w]
+			if end == start:
+				return 0
+			out[start:end] = block.dot(vector)
+			return out[start:end].max()
+
+		def divide(scores, bounds, max_score, w):
+			start, end = bounds[w], bounds[w + 1]
+			if max_score != 0:
+				np.divide(scores[start:end], max_score, out=scores[start:end])
+
+		def change(scores, scores_old, bounds, w):
+			start, end = bounds[w], bounds[w + 1]
+			return _max_change(scores[start:end], scores_old[start:end]) if end > start else 0
+
+		with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+			run = lambda function, *args: list(executor.map(
+				lambda w: function(*(args + (w,))), range(workers)))
 			while True:
-				hubs_old = self.__hubs
-				auths_old = self.__auths
+				details = self.__details
+				product_start = time.time()
+				auths_max = max(run(product, auth_blocks, hubs, new_auths))
+				product_end = time.time()
+				run(divide, new_auths, col_bounds, auths_max)
+
+				hubs_max = max(run(product, hub_blocks, new_auths, new_hubs))
+				hubs_end = time.time()
+				run(divide, new_hubs, hub_bounds, hubs_max)
+
+				hubs_delta = max(run(change, new_hubs, hubs, hub_bounds))
+				auths_delta = max(run(change, new_auths, auths, col_bounds))
+				if details is not None:
+					details['auths_matvec_seconds'] = product_end - product_start
+					details['hubs_matvec_seconds'] = hubs_end - product_end
+					details['auths_max'] = float(auths_max)
+					details['hubs_max'] = float(hubs_max)
+					details['hubs_l1'] = float(hubs.sum())
+					details['auths_l1'] = float(auths.sum())
+
+				hubs, new_hubs = new_hubs, hubs
+				auths, new_auths = new_auths, auths
+				self.__hubs = hubs
+				self.__auths = auths
+				yield hubs_delta, auths_delta
+
+	def __svd_scores(self, epsilon, max_iter, time_budget, start):
+		"""Calculates hubbiness and authority as the leading left and right
+		singular vectors of the link matrix, normalized like power iteration
+
+		When the top singular value is repeated the singular vectors are not
+		unique, and the scores may differ from those found by power iteration.
+		An iteration is a product with A and one with A^T, as for the other
+		engines: ARPACK is stopped once max_iter iterations or time_budget
+		seconds are used up, or when it does not converge by itself. The scores
+		are then left as they were, since ARPACK has no estimate to return
+		"""
+		import scipy.sparse.linalg as sparse_linalg
+
+		link_matrix = self.__link_matrix
+		if not self.__is_sparse:
+			link_matrix = np.asarray(link_matrix, dtype=np.float64)
+		matvecs = [0]
+
+		def check():
+			if max_iter is not None and matvecs[0] >= 2 * max_iter:
+				raise _SolverStopped('max_iter')
+			if time_budget is not None and time.time() - start >= time_budget:
+				raise _SolverStopped('time_budget')
+			matvecs[0] += 1
+
+		def matvec(vector):
+			check()
+			return link_matrix.dot(vector)
+
+		def rmatvec(vector):
+			check()
+			return link_matrix.T.dot(vector)
+
+		self.__stats = ConvergenceStats('svd')
+		self.__stats.stop_reason = 'converged'
+		u = vt = None
+		if min(link_matrix.shape) > 2:
+			operator = sparse_linalg.LinearOperator(
+				link_matrix.shape, matvec=matvec, rmatvec=rmatvec, dtype=np.float64)
+			try:
+				u, _, vt = sparse_linalg.svds(operator, k=1, tol=epsilon,
+					v0=np.ones(min(link_matrix.shape)))
+			except _SolverStopped as e:
+				self.__stats.stop_reason = e.reason
+			except sparse_linalg.ArpackNoConvergence:
+				self.__stats.stop_reason = 'max_iter'
+		else:
+			# ARPACK needs k < n, so tiny graphs are solved densely
+			u, _, vt = np.linalg.svd(sparse.csr_matrix(link_matrix).toarray())
+		if u is not None:
+			self.__hubs = np.abs(u[:, 0]).astype(self.__dtype)
+			self.__auths = np.abs(vt[0]).astype(self.__dtype)
+			_normalize(self.__hubs)
+			_normalize(self.__auths)
+		self.__stats.iterations = matvecs[0] // 2
+		self.__stats.matvecs = matvecs[0]
 
-				self.__auths = np.dot(self.__link_matrix_tr, hubs_old)
-				max_score = self.__auths.max(axis=0)
-				if max_score != 0:
-					self.__auths = self.__auths / max_score
-				self.all_auths.append(self.__auths)
+	def calc_scores_batch(
+		self, hubs=None, masks=None, epsilon=1e-4, max_iter=None, time_budget=None):
+		"""Calculates hubbiness and authority for a block of k runs at once
 
-				self.__hubs = np.dot(self.__link_matrix, self.__auths)
-				max_score = self.__hubs.max(axis=0)
-				if max_score != 0:
-					self.__hubs = self.__hubs / max_score
-				self.all_hubs.append(self.__hubs)
+		All runs are iterated together, with one product of the (sparse) link
+		matrix and a dense n x k block per step. A run whose scores have
+		converged is dropped from the block. Afterwards get_hubs(j) and
+		get_auths(j) return the scores of run j. The scores of calc_scores and
+		the history policy are not affected by batched runs
+
+		Args:
+			hubs: n x k array of the starting hubbiness of each run, or an array
+			of n values used for every run. Defaults to ones for each run given
+			by masks
+			masks: n x k boolean array. Run j is restricted to the nodes whose
+			mask is True, as if HITS were run on only those nodes. An array of n
+			values is used for every run
+			epsilon: Tolerance for convergence, raised like in calc_scores
+			max_iter: If given, stop the runs that have not converged after this
+			many iterations
+			time_budget: If given, stop the runs that have not converged after
+			the iteration during which this many seconds have passed
+		"""
+		if hubs is None:
+			if masks is None:
+				raise ValueError('Either hubs or masks must be given')
+			hubs = np.ones(np.shape(masks))
+		hubs = np.array(hubs, dtype=self.__dtype)
+		if hubs.ndim == 1:
+			hubs = hubs[:, np.newaxis]
+		if masks is not None:
+			masks = np.asarray(masks, dtype=bool)
+			if masks.ndim == 1:
+				masks = masks[:, np.newaxis]
+			# One column of hubs or masks is shared by all runs of the other
+			hubs = hubs * masks
+			masks = np.broadcast_to(masks, hubs.shape)
+		k = hubs.shape[1]
+		auths = np.ones((self.__n_auths, k), dtype=self.__dtype)
+		epsilon = max(epsilon, _min_epsilon(self.__dtype))
+
+		start = time.time()
+		link_matrix_tr = self.__link_matrix.transpose()
+		result_hubs = np.empty((self.__n, k), dtype=self.__dtype)
+		result_auths = np.empty((self.__n_auths, k), dtype=self.__dtype)
+		iterations = np.zeros(k, dtype=np.int64)
+		active = np.arange(k)
+		stop_reason = 'converged'
+		while len(active) > 0:
+			new_auths = np.asarray(link_matrix_tr.dot(hubs))
+			if masks is not None:
+				new_auths *= masks[:, active]
+			_normalize_columns(new_auths)
+
+			new_hubs = np.asarray(self.__link_matrix.dot(new_auths))
+			if masks is not None:
+				new_hubs *= masks[:, active]
+			_normalize_columns(new_hubs)
+
+			iterations[active] += 1
+			converged = ((abs(new_hubs - hubs).max(axis=0) < epsilon)
+				& (abs(new_auths - auths).max(axis=0) < epsilon))
+			if converged.any():
+				result_hubs[:, active[converged]] = new_hubs[:, converged]
+				result_auths[:, active[converged]] = new_auths[:, converged]
+				new_hubs = new_hubs[:, ~converged]
+				new_auths = new_auths[:, ~converged]
+				active = active[~converged]
+			hubs = new_hubs
+			auths = new_auths
+			if len(active) > 0:
+				if max_iter is not None and iterations[active[0]] >= max_iter:
+					stop_reason = 'max_iter'
+				elif time_budget is not None and time.time() - start >= time_budget:
+					stop_reason = 'time_budget'
+				else:
+					continue
+				result_hubs[:, active] = hubs
+				result_auths[:, active] = auths
+				break
+
+		self.__batch_hubs = result_hubs
+		self.__batch_auths = result_auths
+		self.__stats = ConvergenceStats('batch')
+		self.__stats.iterations = iterations
+		self.__stats.matvecs = 2 * int(iterations.sum())
+		self.__stats.stop_reason = stop_reason
+		self.__stats.finish(time.time() - start)
+
+	def __index_of(self, user_id):
+		"""Returns the link matrix index of a user id
+		"""
+		if self.__id_index_map is None:
+			self.__id_index_map = {self.__index_id_map[i]: i for i in self.__index_id_map}
+		return self.__id_index_map[user_id]
+
+	@staticmethod
+	def __choose_sparse(link_matrix, dtype):
+		"""Returns True if link_matrix is better used as a sparse matrix
+		"""
+		n = link_matrix.shape[0]
+		if sparse.issparse(link_matrix):
+			nnz = link_matrix.nnz
+		else:
+			nnz = np.count_nonzero(link_matrix)
+		density = nnz / max(n * n, 1)
+		return not (density >= HITS.AUTO_DENSITY and n * n * dtype.itemsize <= HITS.AUTO_DENSE_BYTES)
+
+	def __set_link_matrix(self, link_matrix):
+		"""Sets the link matrix, converting it to the form (sparse or dense) and
+		type of entries it is to be used with. The arrays of the given matrix
+		are used as they are (eg. left memory-mapped) when no conversion is
+		needed
+		"""
+		if self.__is_sparse:
+			if not sparse.issparse(link_matrix):
+				link_matrix = sparse.csr_matrix(link_matrix)
+			matrix_dtype = self.__matrix_dtype or self.__dtype
+			if link_matrix.dtype != matrix_dtype and link_matrix.format == 'csr':
+				# astype would copy indices and indptr too, reading a memory-mapped
+				# link matrix into memory, so only the entries are converted
+				link_matrix = sparse.csr_matrix((link_matrix.data.astype(matrix_dtype),
+					link_matrix.indices, link_matrix.indptr), shape=link_matrix.shape, copy=False)
+			elif link_matrix.dtype != matrix_dtype:
+				link_matrix = link_matrix.astype(matrix_dtype)
+		else:
+			if sparse.issparse(link_matrix):
+				link_matrix = link_matrix.toarray()
+			if link_matrix.dtype != self.__dtype:
+				link_matrix = link_matrix.astype(self.__dtype)
+		self.__link_matrix = link_matrix
+		self.__n_auths = link_matrix.shape[1]
+		self.__plotters = {}
+
+	def add_nodes(self, users):
+		"""Adds users (with no edges yet) to the end of the link matrix. Their
+		scores start at 1, while those of other users are kept, so the next
+		calc_scores starts from the previous scores
+
+		The users and index_id_map given to __init__ are not changed (and may be
+		read-only, eg. UserStore views): the new users are kept in dictionaries
+		layered over them
+
+		Args:
+			users: Dictionary from user id to user details, of the form
+			{'name': '', 'screen_name': ''}
+		"""
+		new_ids = [user_id for user_id in users if self.__id_index_of(user_id) is None]
+		if len(new_ids) == 0:
+			return
+		if not isinstance(self.__users, collections.ChainMap):
+			self.__users = collections.ChainMap({}, self.__users)
+		if self.__index_id_map is self.__given_index_id_map:
+			self.__index_id_map = collections.ChainMap({}, self.__index_id_map)
+		for user_id in new_ids:
+			self.__index_id_map[self.__n] = user_id
+			self.__id_index_map[user_id] = self.__n
+			self.__users[user_id] = users[user_id]
+			self.__n += 1
+
+		link_matrix = sparse.csr_matrix(self.__link_matrix)
+		indptr = np.concatenate((link_matrix.indptr,
+			np.repeat(link_matrix.indptr[-1], len(new_ids))))
+		self.__set_link_matrix(sparse.csr_matrix(
+			(link_matrix.data, link_matrix.indices, indptr), shape=(self.__n, self.__n)))
+		self.__hubs = np.concatenate((self.__hubs, np.ones(len(new_ids), dtype=self.__dtype)))
+		self.__auths = np.concatenate((self.__auths, np.ones(len(new_ids), dtype=self.__dtype)))
+
+	def __id_index_of(self, user_id):
+		"""Returns the link matrix index of a user id, or None if the user is not
+		in the link matrix
+		"""
+		try:
+			return self.__index_of(user_id)
+		except KeyError:
+			return None
+
+	def add_edges(self, edges, users=None):
+		"""Adds edges to the link matrix in place
+
+		Args:
+			edges: List of (src, dst) user id pairs, meaning src links to
+			(follows) dst
+			users: Dictionary from user id to user details for users in edges
+			that are not in the link matrix yet. These are added by add_nodes
+		"""
+		if users is not None:
+			self.add_nodes(users)
+		link_matrix = sparse.coo_matrix(self.__link_matrix)
+		rows = np.concatenate((link_matrix.row,
+			[self.__index_of(src) for src, _ in edges])).astype(np.int64)
+		cols = np.concatenate((link_matrix.col,
+			[self.__index_of(dst) for _, dst in edges])).astype(np.int64)
+		self.__set_link_matrix(edges_to_csr(
+			rows, cols, self.__n, self.__matrix_dtype or self.__dtype))
+
+	def remove_edges(self, edges):
+		"""Removes edges from the link matrix in place
+
+		Args:
+			edges: List of (src, dst) user id pairs, meaning src links to
+			(follows) dst
+		"""
+		link_matrix = sparse.coo_matrix(self.__link_matrix)
+		keys = link_matrix.row.astype(np.int64) * self.__n + link_matrix.col
+		removed = np.array([self.__index_of(src) * self.__n + self.__index_of(dst)
+			for src, dst in edges], dtype=np.int64)
+		keep = ~np.isin(keys, removed)
+		self.__set_link_matrix(edges_to_csr(link_matrix.row[keep], link_matrix.col[keep],
+			self.__n, self.__matrix_dtype or self.__dtype))
 
-				if (((abs(self.__hubs - hubs_old)) < epsilon_matrix).all()) and (((abs(self.__auths - auths_old)) < epsilon_matrix).all()):
-					break
+	def remove_nodes(self, user_ids):
+		"""Removes users and all their edges from the link matrix in place. The
+		remaining users keep their order and scores, but their indices shift
+		down to fill the gaps
+
+		Args:
+			user_ids: ids of the users to be removed
+		"""
+		keep = np.ones(self.__n, dtype=bool)
+		keep[[self.__index_of(user_id) for user_id in user_ids]] = False
+		link_matrix = sparse.csr_matrix(self.__link_matrix)[keep][:, keep]
+		self.__set_link_matrix(link_matrix.tocsr())
+		self.__hubs = self.__hubs[keep]
+		self.__auths = self.__auths[keep]
+
+		kept_ids = [self.__index_id_map[i] for i in np.flatnonzero(keep)]
+		self.__index_id_map = dict(enumerate(kept_ids))
+		self.__id_index_map = None
+		self.__n = len(kept_ids)
+		self.__names = [self.__users[self.__index_id_map[i]]['screen_name']
+			for i in range(0, min(self.__size, self.__n))]
+
+	def reset_scores(self):
+		"""Sets all scores back to 1, so the next calc_scores starts afresh
+		"""
+		self.__hubs = np.ones(self.__n, dtype=self.__dtype)
+		self.__auths = np.ones(self.__n_auths, dtype=self.__dtype)
+		self.__plotters = {}
+
+	def set_scores(self, hubs=None, auths=None):
+		"""Sets the scores the next calc_scores starts from, eg. to warm start
+		from the scores of an earlier run
+
+		Args:
+			hubs: Hubbiness of each user. Left unchanged if not given
+			auths: Authority of each user. Left unchanged if not given
+		"""
+		if hubs is not None:
+			self.__hubs = np.array(hubs, dtype=self.__dtype)
+		if auths is not None:
+			self.__auths = np.array(auths, dtype=self.__dtype)
+		self.__plotters = {}
+
+	def get_stats(self):
+		"""Returns the ConvergenceStats of the last run of calc_scores (or
+		calc_scores_batch): the engine used, the number of iterations (products
+		with A^T A), the number of products with A or A^T (matvecs), the time
+		taken in seconds and why the iterations stopped
+		"""
+		return self.__stats
+
+	def add_hook(self, hook):
+		"""Adds a function to be called after every iteration of calc_scores
+
+		The function is given a dictionary with the iteration number, the
+		largest (hubs_linf, auths_linf) and total (hubs_l1, auths_l1) change in
+		the scores, the maximum score before normalization (hubs_max,
+		auths_max), the seconds taken by each product (hubs_matvec_seconds,
+		auths_matvec_seconds) and by the whole iteration (seconds). The
+		iterations are also recorded in get_stats(). Engines only measure all of
+		this while a hook is added
+
+		Args:
+			hook: Function taking the dictionary
+		"""
+		self.__hooks.append(hook)
+
+	def remove_hook(self, hook):
+		"""Removes a function added by add_hook
+		"""
+		self.__hooks.remove(hook)
+
+	def __power_steps(self):
+		"""Runs power iteration, yielding the largest change in hubs and in auths
+		after each iteration
+		"""
+		link_matrix_tr = self.__link_matrix.transpose()
+		if self.__is_sparse:
+			matvec = lambda matrix, vector: matrix * vector
+		else:
+			matvec = np.dot
+
+		while True:
+			details = self.__details
+			hubs_old = self.__hubs
+			auths_old = self.__auths
+
+			product_start = time.time()
+			self.__auths = matvec(link_matrix_tr, hubs_old)
+			product_end = time.time()
+			max_score = self.__auths.max(axis=0)
+			if max_score != 0:
+				self.__auths = self.__auths / max_score
+			if details is not None:
+				details['auths_matvec_seconds'] = product_end - product_start
+				details['auths_max'] = float(max_score)
+
+			product_start = time.time()
+			self.__hubs = matvec(self.__link_matrix, self.__auths)
+			product_end = time.time()
+			max_score = self.__hubs.max(axis=0)
+			if max_score != 0:
+				self.__hubs = self.__hubs / max_score
+			if details is not None:
+				details['hubs_matvec_seconds'] = product_end - product_start
+				details['hubs_max'] = float(max_score)
+
+			hubs_change = abs(self.__hubs - hubs_old)
+			auths_change = abs(self.__auths - auths_old)
+			if details is not None:
+				details['hubs_l1'] = float(hubs_change.sum())
+				details['auths_l1'] = float(auths_change.sum())
+			yield hubs_change.max(), auths_change.max()
+
+	def __fused_steps(self):
+		"""Runs power iteration without allocating memory in the iterations,
+		yielding the largest change in hubs and in auths after each iteration
+
+		Both products are computed from the single CSR structure of the link
+		matrix: A^T h by scattering over its rows and A a by gathering over them.
+		Scores are normalized and the changes computed in place in two pairs of
+		buffers that are swapped every iteration
+		"""
+		rows, cols = self.__link_matrix.shape
+		dtype = self.__dtype
+		hubs = np.array(self.__hubs, dtype=dtype)
+		auths = np.array(self.__auths, dtype=dtype)
+		new_hubs = np.empty(rows, dtype=dtype)
+		new_auths = np.empty(cols, dtype=dtype)
+
+		kernel = None
+		if self.__is_sparse:
+			link_matrix = self.__link_matrix.tocsr()
+			indptr = link_matrix.indptr
+			indices = link_matrix.indices
+			# Hooks get fewer details from the kernel, but a pattern is never
+			# converted
+			if self.__details is None or self.__pattern:
+				kernel = _get_fused_kernel()
+			# The compiled kernel reads the entries in whatever type they are
+			# stored in, while scipy's products need the type of the scores
+			matrix_data = link_matrix.data
+			data = matrix_data
+			if kernel is None and data.dtype != dtype:
+				data = data.astype(dtype)
+		else:
+			link_matrix = self.__link_matrix
+
+		while True:
+			details = self.__details
+			if kernel is not None:
+				hubs_delta, auths_delta = kernel(
+					indptr, indices, matrix_data, hubs, auths, new_hubs, new_auths)
+			else:
+				product_start = time.time()
+				if self.__is_sparse:
+					# The CSR arrays of A are the CSC arrays of A^T
+					new_auths.fill(0)
+					_sparsetools.csc_matvec(cols, rows, indptr, indices, data, hubs, new_auths)
+				else:
+					np.dot(link_matrix.T, hubs, out=new_auths)
+				product_end = time.time()
+				auths_max = _normalize(new_auths)
+				if details is not None:
+					details['auths_matvec_seconds'] = product_end - product_start
+					details['auths_max'] = float(auths_max)
+
+				product_start = time.time()
+				if self.__is_sparse:
+					new_hubs.fill(0)
+					_sparsetools.csr_matvec(rows, cols, indptr, indices, data, new_auths, new_hubs)
+				else:
+					np.dot(link_matrix, new_auths, out=new_hubs)
+				product_end = time.time()
+				hubs_max = _normalize(new_hubs)
+				if details is not None:
+					details['hubs_matvec_seconds'] = product_end - product_start
+					details['hubs_max'] = float(hubs_max)
+
+				# The old scores are not needed any more, so the changes are
+				# computed in their buffers
+				hubs_delta = _max_change(new_hubs, hubs)
+				auths_delta = _max_change(new_auths, auths)
+				if details is not None:
+					details['hubs_l1'] = float(hubs.sum())
+					details['auths_l1'] = float(auths.sum())
+
+			hubs, new_hubs = new_hubs, hubs
+			auths, new_auths = new_auths, auths
+			self.__hubs = hubs
+			self.__auths = auths
+			yield hubs_delta, auths_delta
 
 	def get_all_hubs(self):
-		"""Returns the hubbiness score for each user for each iteration
+		"""Returns the hubbiness score for each user for each iteration kept by
+		the history policy
 		"""
 		return self.all_hubs
 
 	def get_all_auths(self):
-		"""Returns the authority score for each user for each iteration
+		"""Returns the authority score for each user for each iteration kept by
+		the history policy
 		"""
 		return self.all_auths
 
-	def get_hubs(self):
+	def get_hubs_history(self):
+		"""Returns the ScoreHistory of the hubbiness scores
+		"""
+		return self.__hubs_history
+
+	def get_auths_history(self):
+		"""Returns the ScoreHistory of the authority scores
+		"""
+		return self.__auths_history
+
+	def get_hubs(self, column=None):
 		"""Returns the hubbiness for each node (user)
+
+		Args:
+			column: Run (or slice of runs) of the last calc_scores_batch to
+			return the scores of, instead of the scores of calc_scores
 		"""
+		if column is not None:
+			if self.__batch_hubs is None:
+				raise ValueError('calc_scores_batch has not been run')
+			return self.__batch_hubs[:, column]
 		return self.__hubs
 
-	def get_auths(self):
+	def get_auths(self, column=None):
 		"""Returns the authority for each node (user)
+
+		Args:
+			column: Run (or slice of runs) of the last calc_scores_batch to
+			return the scores of, instead of the scores of calc_scores
 		"""
+		if column is not None:
+			if self.__batch_auths is None:
+				raise ValueError('calc_scores_batch has not been run')
+			return self.__batch_auths[:, column]
 		return self.__auths
 
 	def get_names(self):
@@ -108,46 +1420,54 @@ class HITS():
 		"""
 		return self.__names
 
-	def plot_graph(self, x, names, c):
-		"""Plots the graph
+	def get_plotter(self, k=None, layout='kk'):
+		"""Returns a GraphPlotter of the top users: the k users with the highest
+		hubbiness together with the k users with the highest authority. The
+		plotter (and so its layout) is kept until the scores or the link matrix
+		change
+
+		Args:
+			k: Number of top users of each kind. Defaults to 30
+			layout: Name of the igraph layout algorithm
 		"""
-		if self.__is_sparse:
-			g = Graph.Adjacency((self.__link_matrix[0:self.__size, 0:self.__size]).toarray().tolist())
-		else:
-			g = Graph.Adjacency((self.__link_matrix[0:self.__size, 0:self.__size]).tolist())
-		g.vs["name"] = names
-		g.vs["attr"] = ["%.3f" % k for k in x]
+		if k is None:
+			k = self.__size
+		if (k, layout) not in self.__plotters:
+			nodes = np.union1d(top_k(self.__hubs, k), top_k(self.__auths, k))
+			names = [self.__users[self.__index_id_map[i]]['screen_name'] for i in nodes.tolist()]
+			self.__plotters[(k, layout)] = GraphPlotter(self.__link_matrix, nodes, names, layout)
+		return self.__plotters[(k, layout)]
 
-		array_min = 0
-		if x.min(axis=0) < 0.001:
-			array_min = 0.001
-		else:
-			array_min = x.min(axis=0)
+	def plot_graph(self, x, names=None, c=0, path=None):
+		"""Plots the graph of the top users (see get_plotter), with the size of
+		each user given by its score
 
-		###layout###
-		layout = g.layout("kk")
-		visual_style = {}
-		visual_style["vertex_size"] = [(x[i]/array_min)*0.3 if x[i]>=0.001 else 10 for i in range(0,min(self.__size,len(x)))]
-		visual_style["vertex_label"] = [(g.vs["name"][i],float(g.vs["attr"][i])) for i in range(0,min(self.__size,len(x)))]
-		color_dict = {"0":"red" , "1":"yellow"}
-		g.vs["color"] = color_dict[str(c)]
-		visual_style["edge_arrow_size"]=2
-		visual_style["vertex_label_size"]=35
-		visual_style["layout"] = layout
-		visual_style["bbox"] = (3200, 2200)
-		visual_style["margin"] = 250
-		visual_style["edge_width"] = 4
-		plot(g, **visual_style)
+		Args:
+			x: Score of each user, eg. get_hubs() or a vector of get_all_hubs()
+			names: Label of each user, indexed by link matrix index (a sequence
+			or a dictionary). Defaults to the screen names of the users plotted
+			c: 0 to color users as hubs, 1 to color them as authorities
+			path: If given, the plot is rendered to this image file in the
+			background (see GraphPlotter.plot) instead of being shown
+		"""
+		return self.get_plotter().plot(x, c, path, names)
 
 	def plot_stats(self):
-		screen_name_index_map = {}
-		for key in self.__index_id_map:
-			screen_name_index_map[self.__users[self.__index_id_map[key]]['screen_name']] = key
-		
+		import matplotlib.pyplot as plt
+		import matplotlib.patches as mp
+
 		cands = ['austinnotduncan', 'str_mape', 'LeoDiCaprio', 'aidanf123', 'MKBHD']
+		store = getattr(self.__users, 'store', None)
+		if store is not None:
+			# Users come from a UserStore, so look the candidates up directly
+			# instead of building a map over all users
+			screen_name_index_map = dict(zip(cands, store.indices_of_screen_names(cands)))
+		else:
+			screen_name_index_map = {}
+			for key in self.__index_id_map:
+				screen_name_index_map[self.__users[self.__index_id_map[key]]['screen_name']] = key
+
 		colors = ['green', 'cyan', 'magenta', 'blue', 'brown']
-		all_hubs = np.array(self.all_hubs)
-		all_auths = np.array(self.all_auths)
 
 		plt.figure(1, figsize=(12, 7))
 		ax = plt.gca()
@@ -156,7 +1476,7 @@ class HITS():
 		legend_handles = []
 		for i in range(len(cands)):
 			legend_handles.append(mp.Patch(label=cands[i], color=colors[i]))
-			ax.plot(np.arange(1, all_hubs.shape[0] + 1), all_hubs[:, screen_name_index_map[cands[i]]], color=colors[i])
+			ax.plot(*self.__hubs_history.series(screen_name_index_map[cands[i]]), color=colors[i])
 		ax.legend(handles=legend_handles)
 		ax.set_title("Change in hubbiness score with increasing iterations")
 		plt.show()
@@ -168,7 +1488,7 @@ class HITS():
 		legend_handles = []
 		for i in range(len(cands)):
 			legend_handles.append(mp.Patch(label=cands[i], color=colors[i]))
-			ax.plot(np.arange(1, all_auths.shape[0] + 1), all_auths[:, screen_name_index_map[cands[i]]], color=colors[i])
+			ax.plot(*self.__auths_history.series(screen_name_index_map[cands[i]]), color=colors[i])
 		ax.legend(handles=legend_handles)
 		ax.set_title("Change in authority score with increasing iterations")
 		plt.show()
@@ -194,6 +1514,18 @@ class DatasetReader():
 			users = pickle.load(f)
 		return users
 
+	def read_user_store(self, user_store_path, use_mmap=True):
+		"""Returns the UserStore (stored in a directory) holding details of all
+		users and the map from link matrix index to user id. Its as_users and
+		as_index_id_map views can be used in place of the dictionaries returned
+		by read_users and read_map
+
+		Args:
+			user_store_path: Path to the directory where the store is saved
+			use_mmap: True if the store is to be memory-mapped
+		"""
+		return UserStore(user_store_path, use_mmap=use_mmap)
+
 	def read_map(self, map_path):
 		"""Returns the dictionary (stored in a file) that represents a map
 		from the link matrix index to user id
@@ -205,13 +1537,20 @@ class DatasetReader():
 			index_id_map = pickle.load(f)
 		return index_id_map
 
-	def read_link_matrix(self, link_matrix_path, is_sparse=False):
+	def read_link_matrix(self, link_matrix_path, is_sparse=False, use_mmap=False):
 		"""Returns the array (stored in a file) that represents the link matrix
 
 		Args:
 			link_matrix_path: Path to the file where the link matrix is stored
 			is_sparse: True if the link matrix is stored as a sparse matrix
+			use_mmap: True if the link matrix is to be memory-mapped instead of
+			read into memory. A sparse link matrix must then have been saved in
+			the format of save_csr_mmap
 		"""
+		if use_mmap:
+			if is_sparse:
+				return load_csr_mmap(link_matrix_path)
+			return np.load(link_matrix_path, mmap_mode='r')
 		with open(link_matrix_path, mode='rb') as f:
 			if is_sparse:
 				link_matrix = sparse.load_npz(link_matrix_path)
@@ -224,6 +1563,7 @@ def main():
 	sparse = True
 	epsilon = 1e-10
 	show_iters = False
+	frames_path = '../data/frames'
 
 	users_path = '../data/users'
 	map_path = '../data/map'
@@ -245,16 +1585,14 @@ def main():
 	h.calc_scores(epsilon=epsilon)
 	
 	if show_iters:
-		x = h.get_all_hubs()
-		for i in x:
-			h.plot_graph(i, h.get_names(),0)
-
-		y = h.get_all_auths()
-		for i in y:
-			h.plot_graph(i, h.get_names(),1)
+		# Frames are rendered to files in the background, all with one layout
+		plotter = h.get_plotter()
+		plotter.plot_history(h.get_hubs_history(), 0, frames_path, 'hubs')
+		plotter.plot_history(h.get_auths_history(), 1, frames_path, 'auths')
+		plotter.close()
 	else:
-		h.plot_graph(h.get_hubs(), h.get_names(),0)
-		h.plot_graph(h.get_auths(), h.get_names(),1)
+		h.plot_graph(h.get_hubs(), c=0)
+		h.plot_graph(h.get_auths(), c=1)
 	
 	# Print graphs
 	h.plot_stats()
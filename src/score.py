@@ -0,0 +1,126 @@
+import argparse
+import sys
+import time
+import numpy as np
+from hits import HITS, DatasetReader
+from score_store import ScoreStore
+
+def load_dataset(args):
+	"""Returns (link_matrix, users, index_id_map) as given by the command line
+	arguments
+
+	Args:
+		args: Parsed command line arguments
+	"""
+	r = DatasetReader()
+	if args.user_store != '':
+		store = r.read_user_store(args.user_store, use_mmap=args.mmap)
+		users = store.as_users()
+		index_id_map = store.as_index_id_map()
+	else:
+		users = r.read_users(args.users)
+		index_id_map = r.read_map(args.map)
+	link_matrix = r.read_link_matrix(
+		args.link_matrix, is_sparse=not args.dense, use_mmap=args.mmap)
+	return link_matrix, users, index_id_map
+
+def save_scores(output_path, hubs, auths, users, index_id_map):
+	"""Saves the scores of all users
+
+	Scores are saved as a .npz archive with arrays ids, hubs and auths if
+	output_path ends with .npz, and as tab separated lines of index, id,
+	screen_name, hubbiness and authority otherwise
+
+	Args:
+		output_path: Path to the file where the scores are to be stored
+		hubs: Hubbiness of each user
+		auths: Authority of each user
+		users: Details of all users
+		index_id_map: Map from link matrix index to user id
+	"""
+	store = getattr(index_id_map, 'store', None)
+	if store is not None:
+		ids = store.get_ids()
+	else:
+		ids = np.array([index_id_map[i] for i in range(len(hubs))], dtype=np.int64)
+
+	if output_path.endswith('.npz'):
+		np.savez(output_path, ids=ids, hubs=hubs, auths=auths)
+		return
+
+	# A UserStore is read by index, rather than by id through its users view
+	if store is not None:
+		screen_name = store.get_screen_name
+	else:
+		screen_name = lambda i: users[int(ids[i])]['screen_name']
+	with open(output_path, 'w', encoding='utf-8') as f:
+		f.write('index\tid\tscreen_name\thubbiness\tauthority\n')
+		for i in range(len(hubs)):
+			f.write('%d\t%d\t%s\t%.10g\t%.10g\n' % (
+				i, ids[i], screen_name(i), hubs[i], auths[i]))
+
+def main(argv=None):
+	"""Scores a dataset without any plotting, for use in batch jobs
+	"""
+	parser = argparse.ArgumentParser(
+		description='Calculate hubbiness and authority of the users of a dataset')
+	parser.add_argument('--users', default='../data/users',
+		help='Path to the pickled users dictionary')
+	parser.add_argument('--map', default='../data/map',
+		help='Path to the pickled map from link matrix index to user id')
+	parser.add_argument('--user-store', default='',
+		help='Path to a UserStore, used instead of --users and --map')
+	parser.add_argument('--link-matrix', default='../data/sparse_link_matrix',
+		help='Path to the link matrix')
+	parser.add_argument('--dense', action='store_true',
+		help='The link matrix is dense')
+	parser.add_argument('--mmap', action='store_true',
+		help='Memory-map the link matrix (and user store)')
+	parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+		help='Type of the scores')
+	parser.add_argument('--pattern', action='store_true',
+		help='Store the entries of a sparse link matrix as 1 byte each (needs numba and --engine fused)')
+	parser.add_argument('--auto', action='store_true',
+		help='Choose whether to use the link matrix sparsely or densely from its size and density')
+	parser.add_argument('--engine', default='power',
+		choices=['power', 'fused', 'parallel', 'svd'], help='Engine of calc_scores')
+	parser.add_argument('--workers', type=int, default=None,
+		help='Number of threads of the parallel engine')
+	parser.add_argument('--prune', action='store_true',
+		help='Leave users without friends or followers out of the products')
+	parser.add_argument('--components', action='store_true',
+		help='Solve each weakly connected component on its own, in parallel')
+	parser.add_argument('--epsilon', type=float, default=1e-10,
+		help='Tolerance for convergence')
+	parser.add_argument('--max-iter', type=int, default=None,
+		help='Maximum number of iterations')
+	parser.add_argument('--output', default='scores.tsv',
+		help='Path to the output file (.npz or tab separated text)')
+	parser.add_argument('--score-store', default='',
+		help='Path to the directory where a ScoreStore of the scores is to be saved')
+	args = parser.parse_args(argv)
+	if args.pattern and args.engine != 'fused':
+		parser.error('--pattern can only be used with --engine fused')
+
+	start = time.time()
+	link_matrix, users, index_id_map = load_dataset(args)
+	loaded = time.time()
+
+	h = HITS(link_matrix, users, index_id_map,
+		is_sparse='auto' if args.auto else not args.dense, history={'enabled': False},
+		dtype=np.dtype(args.dtype), matrix_dtype='pattern' if args.pattern else None)
+	h.calc_scores(epsilon=args.epsilon, engine=args.engine,
+		workers=args.workers, max_iter=args.max_iter, prune=args.prune,
+		components=args.components)
+	scored = time.time()
+
+	save_scores(args.output, h.get_hubs(), h.get_auths(), users, index_id_map)
+	if args.score_store != '':
+		ScoreStore.save(args.score_store, h.get_hubs(), h.get_auths(), index_id_map)
+	stats = h.get_stats()
+	print('Loaded in %.3fs, scored in %.3fs (%s engine, %d iterations), saved in %.3fs' % (
+		loaded - start, scored - loaded, stats['engine'], stats['iterations'],
+		time.time() - scored), file=sys.stderr)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,251 @@
+import argparse
+import functools
+import json
+import os
+import numpy as np
+import http.server
+import urllib.parse
+
+KINDS = ('hubs', 'auths')
+
+def top_k(scores, k):
+	"""Returns the indices of the k highest scores, highest first, using a
+	partial selection instead of sorting all scores
+
+	Args:
+		scores: Array of scores
+		k: Number of indices to return
+	"""
+	k = min(k, len(scores))
+	if k <= 0:
+		return np.array([], dtype=np.int64)
+	top = np.argpartition(-scores, k - 1)[:k]
+	return top[np.lexsort((top, -scores[top]))]
+
+class ScoreStore():
+	"""An instance of ScoreStore answers queries on saved hubbiness and
+	authority scores: the top users, the rank and score of a user and the users
+	between two ranks
+
+	The store is a directory with, for each kind of score, the scores, the
+	indices in order of rank and the rank of each index, all as .npy files
+	that are memory-mapped, along with the sorted ids that lookups by id
+	search. Ranks start at 1 and ties are broken by link
+	matrix index
+	"""
+
+	def __init__(self, score_store_path, use_mmap=True, cache_size=4096, user_store=None):
+		"""Initializes an instance of ScoreStore from a saved store
+
+		Args:
+			score_store_path: Path to the directory the store was saved in
+			use_mmap: True if the arrays are to be memory-mapped instead of read
+			into memory
+			cache_size: Number of user lookups to keep in the LRU cache
+			user_store: A UserStore of the same users, needed for lookups by
+			screen name
+		"""
+		mmap_mode = 'r' if use_mmap else None
+		load = lambda name: np.load(
+			os.path.join(score_store_path, name + '.npy'), mmap_mode=mmap_mode)
+		self._ids = load('ids')
+		self._id_order = load('id_order')
+		if os.path.exists(os.path.join(score_store_path, 'sorted_ids.npy')):
+			self._sorted_ids = load('sorted_ids')
+		else:
+			# Stores saved before the sorted ids were
+			self._sorted_ids = self._ids[self._id_order]
+		self._scores = {kind: load(kind) for kind in KINDS}
+		self._order = {kind: load(kind + '_order') for kind in KINDS}
+		self._rank = {kind: load(kind + '_rank') for kind in KINDS}
+		self._user_store = user_store
+		self._cached_user = functools.lru_cache(maxsize=cache_size)(self._user)
+
+	@staticmethod
+	def save(score_store_path, hubs, auths, index_id_map):
+		"""Saves scores as a score store, precomputing the rank orderings
+
+		Args:
+			score_store_path: Path to the directory to save the store in
+			hubs: Hubbiness of each user
+			auths: Authority of each user
+			index_id_map: Map from link matrix index to user id
+		"""
+		os.makedirs(score_store_path, exist_ok=True)
+		store = getattr(index_id_map, 'store', None)
+		if store is not None:
+			ids = np.asarray(store.get_ids(), dtype=np.int64)
+		else:
+			ids = np.array([index_id_map[i] for i in range(len(hubs))], dtype=np.int64)
+		arrays = {'ids': ids, 'id_order': np.argsort(ids, kind='mergesort')}
+		arrays['sorted_ids'] = ids[arrays['id_order']]
+		for kind, scores in zip(KINDS, (hubs, auths)):
+			scores = np.asarray(scores, dtype=np.float64)
+			order = np.argsort(-scores, kind='mergesort')
+			rank = np.empty(len(order), dtype=np.int64)
+			rank[order] = np.arange(1, len(order) + 1)
+			arrays[kind] = scores
+			arrays[kind + '_order'] = order
+			arrays[kind + '_rank'] = rank
+		for name in arrays:
+			np.save(os.path.join(score_store_path, name + '.npy'), arrays[name])
+
+	def __len__(self):
+		return len(self._ids)
+
+	def _entry(self, kind, index):
+		"""Returns the rank, index, id and score of the user at an index
+		"""
+		return {
+			'rank': int(self._rank[kind][index]),
+			'index': int(index),
+			'id': int(self._ids[index]),
+			'score': float(self._scores[kind][index])
+		}
+
+	def top(self, kind, k):
+		"""Returns the k highest ranked users, highest first
+
+		Args:
+			kind: 'hubs' or 'auths'
+			k: Number of users to return
+		"""
+		return [self._entry(kind, index) for index in self._order[kind][:k]]
+
+	def between(self, kind, a, b):
+		"""Returns the users ranked a to b (both included), highest first
+
+		Args:
+			kind: 'hubs' or 'auths'
+			a: First rank, starting at 1
+			b: Last rank
+		"""
+		return [self._entry(kind, index) for index in self._order[kind][max(a, 1) - 1:b]]
+
+	def index_of(self, user_id=None, screen_name=None):
+		"""Returns the link matrix index of a user given by id or screen name, or
+		None if the user is unknown
+		"""
+		if screen_name is not None:
+			if self._user_store is None:
+				raise ValueError('Lookups by screen name need a UserStore')
+			index = int(self._user_store.indices_of_screen_names([screen_name])[0])
+			return index if index >= 0 else None
+		sorted_ids = self._sorted_ids
+		pos = int(np.searchsorted(sorted_ids, user_id))
+		if pos < len(sorted_ids) and sorted_ids[pos] == user_id:
+			return int(self._id_order[pos])
+		return None
+
+	def user(self, user_id=None, screen_name=None):
+		"""Returns the rank and score of a user for each kind of score, or None
+		if the user is unknown. Lookups are LRU cached, and each call returns its
+		own copy of the cached entries, so callers may modify them
+
+		Args:
+			user_id: id of the user
+			screen_name: screen name of the user, used instead of user_id
+		"""
+		entries = self._cached_user(user_id, screen_name)
+		if entries is None:
+			return None
+		return {kind: dict(entries[kind]) for kind in entries}
+
+	def _user(self, user_id=None, screen_name=None):
+		"""Returns the rank and score of a user for each kind of score, or None
+		if the user is unknown. Called through the LRU cache of user
+
+		Args:
+			user_id: id of the user
+			screen_name: screen name of the user, used instead of user_id
+		"""
+		index = self.index_of(user_id, screen_name)
+		if index is None:
+			return None
+		return {kind: self._entry(kind, index) for kind in KINDS}
+
+def _count(query, name, default=None):
+	"""Returns the non-negative integer parameter name of a query, or default
+	if it is not given. Raises KeyError if it is missing without a default and
+	ValueError if it is not a non-negative integer
+	"""
+	if name not in query and default is not None:
+		return default
+	value = int(query[name])
+	if value < 0:
+		raise ValueError(name + ' must not be negative')
+	return value
+
+def serve(store, host='127.0.0.1', port=8000):
+	"""Serves queries on a ScoreStore over HTTP as JSON until interrupted
+
+	Endpoints are
+		/top?kind=hubs&k=10
+		/range?kind=auths&a=1&b=10
+		/user?id=123 or /user?screen_name=name
+
+	Invalid queries (eg. a negative k) get a 400 response and unknown users a
+	404. Requests are handled on a thread each
+
+	Args:
+		store: The ScoreStore
+		host: Host to listen on
+		port: Port to listen on
+	"""
+
+	class Handler(http.server.BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			url = urllib.parse.urlparse(self.path)
+			query = dict(urllib.parse.parse_qsl(url.query))
+			try:
+				kind = query.get('kind', 'hubs')
+				if kind not in KINDS:
+					raise ValueError('kind must be hubs or auths')
+				if url.path == '/top':
+					result = store.top(kind, _count(query, 'k', 10))
+				elif url.path == '/range':
+					result = store.between(kind, _count(query, 'a'), _count(query, 'b'))
+				elif url.path == '/user':
+					if 'screen_name' in query:
+						result = store.user(screen_name=query['screen_name'])
+					else:
+						result = store.user(int(query['id']))
+					if result is None:
+						self.send_error(404, 'Unknown user')
+						return
+				else:
+					self.send_error(404)
+					return
+			except (KeyError, ValueError) as e:
+				self.send_error(400, repr(e))
+				return
+			body = json.dumps(result).encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	http.server.ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+def main():
+	parser = argparse.ArgumentParser(description='Serve queries on a score store')
+	parser.add_argument('score_store', help='Path to the score store')
+	parser.add_argument('--user-store', default='',
+		help='Path to the UserStore, for lookups by screen name')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8000)
+	args = parser.parse_args()
+
+	user_store = None
+	if args.user_store != '':
+		from dataset_fetcher import UserStore
+		user_store = UserStore(args.user_store)
+	serve(ScoreStore(args.score_store, user_store=user_store), args.host, args.port)
+
+if __name__ == '__main__':
+	main()